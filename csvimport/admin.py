@@ -5,49 +5,59 @@ from django.contrib import admin
 from django.contrib.admin import ModelAdmin
 
 from csvimport.models import CSVImport
+from csvimport.executor import get_executor
+from csvimport.reader import open_reader
+from csvimport.management.commands.csvimport import CSVIMPORT_CHARSET_SAMPLE
 
 class CSVImportAdmin(ModelAdmin):
     ''' Custom model to not have much editable! '''
     readonly_fields = ['file_name',
                        'upload_method',
                        'error_log_html',
-                       'import_user']
+                       'import_user',
+                       'status',
+                       'rows_processed',
+                       'rows_per_second',
+                       'stats',
+                       'checkpoint_row']
     fields = [
                 'model_name',
                 'field_list',
                 'upload_file',
+                'sheet',
                 'file_name',
                 'encoding',
                 'upload_method',
                 'error_log_html',
-                'import_user']
+                'import_user',
+                'status',
+                'rows_processed',
+                'rows_per_second',
+                'stats',
+                'checkpoint_row']
     formfield_overrides = {
         models.CharField: {'widget': forms.Textarea(attrs={'rows':'4',
                                                            'cols':'60'})},
         }
 
     def save_model(self, request, obj, form, change):
-        """ Do save and process command - cant commit False
+        """ Do save and hand the import to the executor - cant commit False
             since then file wont be found for reopening via right charset
         """
         form.save()
-        from csvimport.management.commands.csvimport import Command
-        cmd = Command()
-        if obj.upload_file:
-            obj.file_name = obj.upload_file.name
-            obj.encoding = ''
-            defaults = self.filename_defaults(obj.file_name)
-            cmd.setup(mappings=obj.field_list,
-                      modelname=obj.model_name,
-                      charset=obj.encoding,
-                      uploaded=obj.upload_file,
-                      defaults=defaults)
-        errors = cmd.run(logid=obj.id)
-        if errors:
-            obj.error_log = '\n'.join(errors)
         obj.import_user = str(request.user)
         obj.import_date = datetime.now()
+        if not obj.upload_file:
+            obj.save()
+            return
+        obj.file_name = obj.upload_file.name
+        # Detect the charset once here, the import reads with it
+        obj.encoding = open_reader(obj.upload_file.path,
+                                   sample=CSVIMPORT_CHARSET_SAMPLE).charset
+        obj.defaults = self.filename_defaults(obj.file_name) or ''
+        obj.status = 'queued'
         obj.save()
+        get_executor().submit(obj)
 
     def filename_defaults(self, filename):
         """ Override this method to supply filename based data """
@@ -0,0 +1,74 @@
+""" Cache of resolved related model instances for an import """
+from collections import OrderedDict
+
+from csvimport.dedup import DeduplicateIndex
+
+
+class RelatedCache(object):
+    """ Least recently used cache from the match key of a related model
+        to its pk and the values of its imported fields, so that feeds
+        repeating the same related rows only look each one up once.
+    """
+
+    def __init__(self, model, match_fields, maxsize=10000):
+        self.model = model
+        self.index = DeduplicateIndex(model, match_fields)
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, matchdict):
+        """ The cache key for the values matched on """
+        return self.index.key(matchdict)
+
+    def normalise(self, values):
+        """ Field values in the form they are read from the database """
+        return dict([(name, self.index.normalise(name, value))
+                     for name, value in values.items()])
+
+    def get(self, key):
+        """ Return the (pk, values) for a key, or None if it is not cached """
+        try:
+            entry = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = entry
+        self.hits += 1
+        return entry
+
+    def put(self, key, pk, values):
+        """ Cache the pk and normalised field values for a key """
+        if key is None or self.maxsize < 1:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = (pk, self.normalise(values))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def instance(self, pk, values):
+        """ An instance with the cached pk and values to assign to the
+            foreign key without querying for it
+        """
+        instance = self.model(**values)
+        instance.pk = pk
+        # It is already saved, so saving it again updates the row
+        instance._state.adding = False
+        return instance
+
+    def warm(self, fields):
+        """ Fill the cache from the database with one query """
+        names = list(self.index.fields)
+        names.extend([name for name in fields if name not in names])
+        pkname = self.model._meta.pk.name
+        for values in self.model.objects.values(pkname, *names)[:self.maxsize]:
+            pk = values[pkname]
+            if pkname not in names:
+                del values[pkname]
+            self.put(self.key(values), pk, values)
+
+    def summary(self):
+        """ Log line of the cache use """
+        return 'Related %s cache: %s hits, %s misses' % (
+            self.model.__name__, self.hits, self.misses)
@@ -0,0 +1,55 @@
+""" Transactions spanning many rows of an import, with each batch in a
+    savepoint so that a failed batch can be split to find its bad rows
+    without losing the rest of the transaction
+"""
+from django.db import DatabaseError, transaction
+
+
+class CommitGroups(object):
+    """ An atomic block around an import which is committed, and a new
+        one begun, at each call to commit, so that a large import is a
+        series of transactions of many rows rather than one per row
+        Inside an existing transaction the groups are savepoints.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.block = None
+
+    def __enter__(self):
+        self.block = transaction.atomic(using=self.using)
+        self.block.__enter__()
+        return self
+
+    def commit(self):
+        self.block.__exit__(None, None, None)
+        self.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.block.__exit__(*exc_info)
+
+
+def write_bisecting(instances, write, failed, using=None):
+    """ Call write with the instances in a savepoint. If it fails the
+        savepoint is rolled back and each half is written in the same way,
+        until the rows that fail alone are found and passed to failed
+        with their error.
+        Returns the number of instances written
+    """
+    # Rolling back must also undo the primary keys and saved state
+    state = [(instance, instance.pk, instance._state.adding)
+             for instance in instances]
+    try:
+        with transaction.atomic(using=using):
+            write(instances)
+        return len(instances)
+    except DatabaseError, err:
+        for instance, pk, adding in state:
+            instance.pk = pk
+            instance._state.adding = adding
+        if len(instances) == 1:
+            failed(instances[0], err)
+            return 0
+        half = len(instances) // 2
+        return (write_bisecting(instances[:half], write, failed, using) +
+                write_bisecting(instances[half:], write, failed, using))
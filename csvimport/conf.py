@@ -5,3 +5,5 @@ from django.conf import settings
 class CSVImportConf(AppConf):
     MODELS = []
     MEDIA_ROOT = settings.MEDIA_ROOT
+    # Runs the imports of admin uploads
+    EXECUTOR = 'csvimport.executor.DatabaseQueue'
@@ -0,0 +1,153 @@
+""" Parsing of date columns in a format inferred from a sample of rows
+
+    Each built in format has a parser that slices or splits the value,
+    rather than calling strptime for every cell, and handles an optional
+    time. Parsed values are memoised since date columns often repeat.
+    Other formats can be given for strptime with CSVIMPORT_DATE_FORMATS.
+"""
+from datetime import date, datetime
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from csvimport.errors import NOT_A_DATE
+
+# Extra strptime formats tried, in order, after the built in ones
+CSVIMPORT_DATE_FORMATS = getattr(settings, 'CSVIMPORT_DATE_FORMATS', ())
+# Maximum number of distinct values memoised for each date column
+MEMO_SIZE = 10000
+
+
+def parse_iso(value):
+    """ YYYY-MM-DD with an optional time, fraction and time zone """
+    if len(value) == 10:
+        if value[4] != '-' or value[7] != '-':
+            raise ValueError(value)
+        return date(int(value[:4]), int(value[5:7]), int(value[8:]))
+    if len(value) == 19 and value[10] in ' T' and value[13] == ':':
+        if value[4] != '-' or value[7] != '-' or value[16] != ':':
+            raise ValueError(value)
+        return datetime(int(value[:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]),
+                        int(value[17:]))
+    # Months and days may be unpadded
+    parsed = parse_date(value) or parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+def parse_slashes(value, day_first):
+    """ Day or month first, then the year, with an optional time of
+        hours, minutes and seconds
+    """
+    day, time = (value.split(' ', 1) + [''])[:2]
+    first, second, year = day.split('/')
+    if len(year) != 4:
+        raise ValueError(value)
+    if day_first:
+        first, second = second, first
+    if not time:
+        return date(int(year), int(first), int(second))
+    time = [int(part) for part in time.split(':')]
+    if not 2 <= len(time) <= 3:
+        raise ValueError(value)
+    return datetime(int(year), int(first), int(second), *time)
+
+
+def parse_day_first(value):
+    return parse_slashes(value, True)
+
+
+def parse_month_first(value):
+    return parse_slashes(value, False)
+
+
+def strptime_parser(format):
+    def parse(value):
+        return datetime.strptime(value, format)
+    return parse
+
+# Formats in order of preference when a sample fits more than one
+FORMATS = [('ISO', parse_iso), ('%d/%m/%Y', parse_day_first),
+           ('%m/%d/%Y', parse_month_first)] + \
+          [(format, strptime_parser(format))
+           for format in CSVIMPORT_DATE_FORMATS]
+
+
+def parsed_count(parser, values):
+    """ The number of the values the parser can parse """
+    count = 0
+    for value in values:
+        try:
+            parser(value)
+            count += 1
+        except (ValueError, TypeError):
+            pass
+    return count
+
+
+class DateConverter(object):
+    """ Convert the values of a date column to dates, or to datetimes for
+        a DateTimeField, logging the values that are not in its format
+    """
+
+    def __init__(self, datetimes=False):
+        self.datetimes = datetimes
+        self.format, self.parser = FORMATS[0]
+        self.memo = {}
+
+    def infer(self, values):
+        """ Use the format that parses most of a sample of the values,
+            preferring the earlier formats
+        """
+        best = 0
+        for format, parser in FORMATS:
+            count = parsed_count(parser, values)
+            if count > best:
+                best = count
+                self.format, self.parser = format, parser
+            if count == len(values):
+                break
+        self.memo = {}
+
+    def finish(self, value):
+        """ Make the parsed value a date, or a datetime which is aware if
+            time zones are used
+        """
+        if not self.datetimes:
+            if isinstance(value, datetime):
+                return value.date()
+            return value
+        if not isinstance(value, datetime):
+            value = datetime(value.year, value.month, value.day)
+        if settings.USE_TZ:
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value,
+                                            timezone.get_default_timezone())
+        elif timezone.is_aware(value):
+            value = timezone.make_naive(value,
+                                        timezone.get_default_timezone())
+        return value
+
+    def __call__(self, value, field, errors):
+        if not value:
+            return None
+        if isinstance(value, date):
+            # A spreadsheet date cell needs no parsing
+            return self.finish(value)
+        try:
+            return self.memo[value]
+        except KeyError:
+            pass
+        try:
+            parsed = self.finish(self.parser(value))
+        except (ValueError, TypeError):
+            errors.add(field, NOT_A_DATE,
+                       'Column %s = %s is not a date in the format %s so '
+                       'is set to None' % (field, value, self.format))
+            return None
+        if len(self.memo) < MEMO_SIZE:
+            self.memo[value] = parsed
+        return parsed
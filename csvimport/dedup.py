@@ -0,0 +1,113 @@
+""" Deduplication of imported rows against existing rows in batches """
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
+
+# Keep well under the 999 query parameter limit of SQLite
+MAX_PARAMS = 900
+
+
+class DeduplicateIndex(object):
+    """ Match a batch of imported rows to the existing model instances
+        with one query, rather than one get() per row.
+
+        Rows are matched on the given fields, skipping any the row has
+        no value for, as the per row get(**matchdict) did.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = []
+        self.fieldmap = dict([(field.name, field)
+                              for field in model._meta.fields])
+        for name in fields:
+            if name not in self.fields:
+                self.fields.append(name)
+
+    def normalise(self, name, value):
+        """ Convert a value to the form it has when read from the database """
+        if isinstance(value, models.Model):
+            return value.pk
+        field = self.fieldmap[name]
+        if isinstance(field, models.ForeignKey):
+            field = field.rel.get_related_field()
+        if isinstance(value, float) and isinstance(field, models.DecimalField):
+            value = repr(value)
+        try:
+            return field.to_python(value)
+        except ValidationError:
+            return value
+
+    def key(self, values):
+        """ The hashable deduplication key for a dictionary of field values,
+            or None if none of the match fields have a value
+        """
+        names = tuple([name for name in self.fields if name in values])
+        if not names:
+            return None
+        return (names, tuple([self.normalise(name, values[name])
+                              for name in names]))
+
+    def instance_key(self, names, instance):
+        """ The deduplication key of an existing instance """
+        return (names, tuple([getattr(instance, self.fieldmap[name].attname)
+                              for name in names]))
+
+    def update(self, instance, values):
+        """ Set the values on an existing instance
+            Returns True if any of them changed
+        """
+        changed = False
+        for name, value in values.iteritems():
+            attname = self.fieldmap[name].attname
+            if getattr(instance, attname) != self.normalise(name, value):
+                setattr(instance, name, value)
+                changed = True
+        return changed
+
+    def existing(self, keys):
+        """ Fetch the existing instances for a list of keys with as few
+            queries as the database parameter limit allows
+            Returns a dictionary of key to instance
+        """
+        groups = {}
+        for key in keys:
+            if key:
+                groups.setdefault(key[0], set()).add(key[1])
+        terms = []
+        for names, values in groups.items():
+            attnames = [self.fieldmap[name].attname for name in names]
+            if len(names) == 1:
+                # NULL never matches IN so look for it separately
+                values = [value[0] for value in values]
+                if None in values:
+                    values.remove(None)
+                    terms.append((1, Q(**{'%s__isnull' % attnames[0]: True})))
+                for start in range(0, len(values), MAX_PARAMS):
+                    chunk = values[start:start + MAX_PARAMS]
+                    terms.append((len(chunk),
+                                  Q(**{'%s__in' % attnames[0]: chunk})))
+            else:
+                for value in values:
+                    terms.append((len(names), Q(**dict(zip(attnames, value)))))
+
+        found = {}
+
+        def fetch(query):
+            for instance in self.model.objects.filter(query):
+                for names in groups:
+                    found.setdefault(self.instance_key(names, instance),
+                                     instance)
+
+        query = None
+        params = 0
+        for size, term in terms:
+            if query is not None and params + size > MAX_PARAMS:
+                fetch(query)
+                query = None
+                params = 0
+            query = term if query is None else query | term
+            params += size
+        if query is not None:
+            fetch(query)
+        return found
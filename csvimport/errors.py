@@ -0,0 +1,78 @@
+""" Bounded log of the errors in the rows of an import
+
+    Errors are counted for each column and kind of error, and only the
+    first few messages of each are kept, so a dirty file cannot fill the
+    memory or the CSVImport log. Every error can also be written to a
+    csv side file. The kept messages are logged as they are added.
+"""
+import csv
+from collections import OrderedDict
+
+# Kinds of errors
+NOT_A_NUMBER = 'not a number'
+TOO_BIG = 'more than the max integer'
+TOO_SMALL = 'less than the min integer'
+NOT_AN_INTEGER = 'not an integer'
+NEGATIVE = 'less than zero'
+NOT_A_DATE = 'not a date'
+DATABASE = 'database error'
+DEBUG = 'debug'
+
+
+class ErrorLog(object):
+    """ Counts of errors by (column, kind) with samples of their messages """
+
+    def __init__(self, samples=10, path='', logger=None):
+        self.samples = samples
+        self.path = path
+        self.logger = logger
+        self.counts = OrderedDict()
+        self.messages = {}
+        self.row = 0
+        self.detail = None
+        self.writer = None
+
+    def add(self, column, kind, message):
+        """ Count an error in the current row """
+        key = (column or '', kind)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count <= self.samples:
+            self.messages.setdefault(key, []).append(message)
+            if self.logger:
+                self.logger.info(message)
+        if self.path:
+            if self.writer is None:
+                self.detail = open(self.path, 'ab')
+                self.writer = csv.writer(self.detail)
+            self.writer.writerow([self.row, key[0], kind,
+                                  unicode(message).encode('utf-8')])
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def lines(self, samples=True):
+        """ The sample messages of each kind of error, followed by
+            the number of errors of that kind that were not kept
+        """
+        lines = []
+        for (column, kind), count in self.counts.items():
+            messages = self.messages.get((column, kind), [])
+            if samples:
+                lines.extend(messages)
+            if count > len(messages):
+                lines.append('%s more %s errors%s' % (
+                    count - len(messages), kind,
+                    column and ' in column %s' % column or ''))
+        return lines
+
+    def as_dict(self):
+        """ The error counts as a dictionary that can be saved as json """
+        return dict([('%s: %s' % key if key[0] else key[1], count)
+                     for key, count in self.counts.items()])
+
+    def close(self):
+        if self.detail:
+            self.detail.close()
+            self.detail = None
+            self.writer = None
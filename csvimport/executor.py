@@ -0,0 +1,75 @@
+""" Running the imports of admin uploads outside the web request
+
+    The executor used is set by CSVIMPORT_EXECUTOR. The default
+    DatabaseQueue marks the upload as queued for a csvimport_worker
+    command to import, and ImmediateExecutor imports it straight away.
+"""
+from datetime import datetime
+
+from django.utils.importlib import import_module
+
+from csvimport.conf import settings
+from csvimport.models import CSVImport
+
+
+def get_executor():
+    """ The executor class named by the CSVIMPORT_EXECUTOR setting """
+    module, name = settings.CSVIMPORT_EXECUTOR.rsplit('.', 1)
+    return getattr(import_module(module), name)()
+
+
+def run_import(csvimp):
+    """ Import the uploaded file of a CSVImport and log the result on it """
+    from csvimport.management.commands.csvimport import Command
+    CSVImport.objects.filter(pk=csvimp.pk).update(status='running')
+    cmd = Command()
+    try:
+        cmd.setup(mappings=csvimp.field_list,
+                  modelname=csvimp.model_name,
+                  charset=csvimp.encoding,
+                  uploaded=csvimp.upload_file,
+                  sheet=csvimp.sheet,
+                  defaults=csvimp.defaults)
+        errors = cmd.run(logid=csvimp.id)
+        status = 'done'
+    except Exception, err:
+        errors = cmd.loglist + ['Import failed: %s' % err]
+        status = 'failed'
+    # Reload to keep the progress the command has checkpointed
+    csvimp = CSVImport.objects.get(pk=csvimp.pk)
+    csvimp.encoding = cmd.encoding_label()
+    csvimp.error_log = '\n'.join(errors)
+    csvimp.status = status
+    csvimp.rows_processed = cmd.rowcount
+    csvimp.rows_per_second = cmd.stats.rows_per_second()
+    csvimp.stats = cmd.stats_json()
+    csvimp.import_date = datetime.now()
+    csvimp.save()
+    return csvimp
+
+
+class ImmediateExecutor(object):
+    """ Import in the current process, blocking until it is done """
+
+    def submit(self, csvimp):
+        return run_import(csvimp)
+
+
+class DatabaseQueue(object):
+    """ Queue the import for the csvimport_worker command """
+
+    def submit(self, csvimp):
+        CSVImport.objects.filter(pk=csvimp.pk).update(status='queued')
+        csvimp.status = 'queued'
+        return csvimp
+
+    def claim(self):
+        """ Take the oldest queued import, or return None if there is
+            none. The status update only succeeds for one worker.
+        """
+        for csvimp in CSVImport.objects.filter(status='queued').order_by('id'):
+            if CSVImport.objects.filter(pk=csvimp.pk, status='queued'
+                                        ).update(status='running'):
+                csvimp.status = 'running'
+                return csvimp
+        return None
@@ -0,0 +1,208 @@
+""" Backends writing the new rows of a batch to the database
+
+    The ORM loader uses bulk_create. The executemany loader inserts the
+    batch with one prepared statement in a transaction, as SQLite prefers,
+    and the copy loader streams the batch into a staging table with
+    PostgreSQL's COPY then merges it into the model's table.
+    By default the loader is picked from the database vendor.
+"""
+from cStringIO import StringIO
+
+from django.db import connections, router, transaction
+
+from csvimport.dedup import MAX_PARAMS
+
+# The loader used for each database vendor if none is chosen
+VENDOR_LOADERS = {'postgresql': 'copy', 'sqlite': 'executemany'}
+
+
+class Loader(object):
+    """ Write new instances of a model with bulk_create """
+    vendors = None
+
+    def __init__(self, model, match_fields=()):
+        self.model = model
+        self.connection = connections[router.db_for_write(model)]
+        local_fields = model._meta.local_fields
+        # An automatic primary key is left to the database unless it is set
+        self.auto_pk = None
+        if model._meta.pk in local_fields and \
+               model._meta.pk.get_internal_type() in ('AutoField',
+                                                      'BigAutoField'):
+            self.auto_pk = model._meta.pk
+        self.all_fields = list(local_fields)
+        self.fields = [field for field in local_fields
+                       if field is not self.auto_pk]
+        self.match = [field for field in model._meta.local_fields
+                      if field.name in match_fields
+                      or field.attname in match_fields]
+
+    def fields_for(self, instances):
+        """ The fields to write for the instances, with the automatic
+            primary key if any of them has it set, as a mapped id does
+        """
+        if self.auto_pk and [instance for instance in instances
+                             if instance.pk is not None]:
+            return self.all_fields
+        return self.fields
+
+    def values(self, instance, fields=None):
+        """ The database values of an instance's fields """
+        return [field.get_db_prep_save(field.pre_save(instance, True),
+                                       connection=self.connection)
+                for field in fields or self.fields]
+
+    def quoted_columns(self, fields=None):
+        qn = self.connection.ops.quote_name
+        return ', '.join([qn(field.column) for field in fields or self.fields])
+
+    def load(self, instances):
+        self.model.objects.bulk_create(instances)
+
+
+class ExecuteManyLoader(Loader):
+    """ Insert the instances with executemany in one transaction """
+    vendors = ('sqlite',)
+
+    def load(self, instances):
+        fields = self.fields_for(instances)
+        sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+            self.connection.ops.quote_name(self.model._meta.db_table),
+            self.quoted_columns(fields), ', '.join(['%s'] * len(fields)))
+        with transaction.atomic(using=self.connection.alias,
+                                savepoint=False):
+            self.connection.cursor().executemany(
+                sql, [self.values(instance, fields) for instance in instances])
+
+
+class CopyLoader(Loader):
+    """ COPY the instances into a temporary staging table, then insert
+        those not already in the table, matching on the match fields
+    """
+    vendors = ('postgresql',)
+
+    def __init__(self, model, match_fields=()):
+        super(CopyLoader, self).__init__(model, match_fields)
+        self.staging = self.connection.ops.quote_name(
+            'csvimport_staging_%s' % model._meta.db_table)
+
+    def csv_value(self, value):
+        """ A value in PostgreSQL's csv format, where only an unquoted
+            empty value is null
+        """
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return '"%s"' % str(value).replace('"', '""')
+
+    def create_staging(self, cursor):
+        """ Create the staging table unless this transaction already has,
+            as a reused connection or a rolled back savepoint may not
+        """
+        cursor.execute('CREATE TEMPORARY TABLE IF NOT EXISTS %s '
+                       '(LIKE %s INCLUDING DEFAULTS) ON COMMIT DROP' % (
+                       self.staging, self.connection.ops.quote_name(
+                           self.model._meta.db_table)))
+
+    def load(self, instances):
+        qn = self.connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        fields = self.fields_for(instances)
+        columns = self.quoted_columns(fields)
+        data = StringIO()
+        for instance in instances:
+            data.write(','.join([self.csv_value(value)
+                                 for value in self.values(instance, fields)]))
+            data.write('\n')
+        data.seek(0)
+        with transaction.atomic(using=self.connection.alias,
+                                savepoint=False):
+            cursor = self.connection.cursor()
+            self.create_staging(cursor)
+            cursor.copy_expert('COPY %s (%s) FROM STDIN WITH CSV'
+                               % (self.staging, columns), data)
+            sql = 'INSERT INTO %s (%s) SELECT %s FROM %s staged' % (
+                table, columns, columns, self.staging)
+            if self.match:
+                sql += ' WHERE NOT EXISTS (SELECT 1 FROM %s WHERE %s)' % (
+                    table, ' AND '.join(['%s.%s = staged.%s' % (
+                        table, qn(field.column), qn(field.column))
+                        for field in self.match]))
+            cursor.execute(sql)
+            cursor.execute('TRUNCATE %s' % self.staging)
+
+
+class ReturningLoader(Loader):
+    """ Insert the instances and set their automatic primary keys, which
+        bulk_create does not, with one statement per chunk of rows.
+        PostgreSQL returns the keys, and SQLite numbers the rows of an
+        insert one after another up to the last row id.
+    """
+    vendors = ('postgresql', 'sqlite')
+
+    @classmethod
+    def supported(cls, connection):
+        """ Can the database insert several rows with one statement and
+            tell their keys
+        """
+        if connection.vendor == 'sqlite':
+            from sqlite3 import sqlite_version_info
+            return sqlite_version_info >= (3, 7, 11)
+        return connection.vendor in cls.vendors
+
+    def load(self, instances):
+        if not self.auto_pk:
+            # The primary keys are set by the import
+            return super(ReturningLoader, self).load(instances)
+        keyed = [instance for instance in instances if instance.pk is not None]
+        if keyed:
+            super(ReturningLoader, self).load(keyed)
+        new = [instance for instance in instances if instance.pk is None]
+        if not self.fields:
+            # There are no values to insert but the key
+            for instance in new:
+                instance.save(force_insert=True)
+            return
+        qn = self.connection.ops.quote_name
+        row = '(%s)' % ', '.join(['%s'] * len(self.fields))
+        size = max(1, MAX_PARAMS // len(self.fields))
+        cursor = self.connection.cursor()
+        for start in range(0, len(new), size):
+            chunk = new[start:start + size]
+            params = []
+            for instance in chunk:
+                params.extend(self.values(instance))
+            sql = 'INSERT INTO %s (%s) VALUES %s' % (
+                qn(self.model._meta.db_table), self.quoted_columns(),
+                ', '.join([row] * len(chunk)))
+            if self.connection.vendor == 'postgresql':
+                cursor.execute(sql + ' RETURNING %s' % qn(self.auto_pk.column),
+                               params)
+                pks = [found[0] for found in cursor.fetchall()]
+            else:
+                cursor.execute(sql, params)
+                pks = range(cursor.lastrowid - len(chunk) + 1,
+                            cursor.lastrowid + 1)
+            for instance, pk in zip(chunk, pks):
+                instance.pk = pk
+
+
+LOADERS = {'orm': Loader, 'executemany': ExecuteManyLoader,
+           'copy': CopyLoader}
+
+
+def get_loader(model, name='', match_fields=()):
+    """ The loader for the model's database, the named one if given
+        Returns the loader and, if the named one could not be used, why not
+    """
+    vendor = connections[router.db_for_write(model)].vendor
+    reason = ''
+    if name and name not in LOADERS:
+        reason = 'there is no %s loader' % name
+    elif name and LOADERS[name].vendors and vendor not in LOADERS[name].vendors:
+        reason = 'the %s loader does not support %s' % (name, vendor)
+    elif name:
+        return LOADERS[name](model, match_fields), reason
+    loader = LOADERS[VENDOR_LOADERS.get(vendor, 'orm')]
+    return loader(model, match_fields), reason
@@ -1,60 +1,95 @@
 # Run sql files via django#
 # www.heliosfoundation.org
-import os, csv, re
+import os
+import itertools
+from collections import OrderedDict
+import json
+import multiprocessing
 from datetime import datetime
-import codecs
-import chardet
-from ...signals import imported_csv, importing_csv
-
-from django.db import DatabaseError
+from ...signals import imported_csv, importing_csv, imported_csv_batch, \
+     importing_csv_batch
+from ...dedup import DeduplicateIndex
+from ...related import RelatedResolver
+from ...stats import ImportStats
+from ...errors import ErrorLog, DATABASE
+from ...upsert import Upsert
+from ...loaders import get_loader, LOADERS
+from ...commits import CommitGroups, write_bisecting
+from ...parallel import record_boundaries, close_connection, \
+     import_range, import_file
+from ...reader import ascii_compatible, file_fingerprint, csv_sources, \
+     open_reader, CHARSET_SAMPLE
+from ...xlsx import XLSXReader
+from ...metadata import field_map, related_model, parse_mappings
+from ...plan import ImportPlan, INTEGER, FLOAT, NUMERIC, BOOLEAN, \
+     BOOLEAN_TRUE, DATEFIELD
+
+from django.db import router
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import LabelCommand, BaseCommand
 from optparse import make_option
 from django.db import models
-from django.contrib.contenttypes.models import ContentType
 
 # import pdb
 
 from django.conf import settings
 CSVIMPORT_LOG = getattr(settings, 'CSVIMPORT_LOG', 'screen')
+# Maximum number of related model instances cached during an import
+CSVIMPORT_FK_CACHE_SIZE = getattr(settings, 'CSVIMPORT_FK_CACHE_SIZE', 10000)
+# Minimum number of rows between commits, and checkpoints of the import
+# progress
+CSVIMPORT_CHECKPOINT_ROWS = getattr(settings, 'CSVIMPORT_CHECKPOINT_ROWS', 1000)
+# Time each stage of the import and count its queries
+CSVIMPORT_STATS = getattr(settings, 'CSVIMPORT_STATS', False)
+# Number of messages kept for each column and kind of error
+CSVIMPORT_ERROR_SAMPLES = getattr(settings, 'CSVIMPORT_ERROR_SAMPLES', 10)
+# Minimum number of seconds between progress logging and callbacks
+CSVIMPORT_PROGRESS_SECONDS = getattr(settings, 'CSVIMPORT_PROGRESS_SECONDS', 5)
+# Number of rows sampled to infer the format of each date column
+CSVIMPORT_DATE_SAMPLE = getattr(settings, 'CSVIMPORT_DATE_SAMPLE', 100)
+# Maximum number of bytes read from a file to detect its charset
+CSVIMPORT_CHARSET_SAMPLE = getattr(settings, 'CSVIMPORT_CHARSET_SAMPLE',
+                                   CHARSET_SAMPLE)
 if CSVIMPORT_LOG == 'logger':
     import logging
     logger = logging.getLogger(__name__)
+else:
+    logger = None
 
-INTEGER = ['BigIntegerField', 'IntegerField', 'AutoField',
-           'PositiveIntegerField', 'PositiveSmallIntegerField']
-FLOAT = ['DecimalField', 'FloatField']
-NUMERIC = INTEGER + FLOAT
-BOOLEAN = ['BooleanField', 'NullBooleanField']
-BOOLEAN_TRUE = [1, '1', 'Y', 'Yes', 'yes', 'True', 'true', 'T', 't']
-DATEFIELD = ['DateField', 'DateTimeField']
 # Note if mappings are manually specified they are of the following form ...
 # MAPPINGS = "column1=shared_code,column2=org(Organisation|name),column3=description"
 # statements = re.compile(r";[ \t]*$", re.M)
-
-def save_csvimport(props=None, instance=None):
-    """ To avoid circular imports do saves here """
+def save_csvimport(props=None, instance=None, csvimport_id=None):
+    """ To avoid circular imports do saves here
+        Updates the CSVImport with csvimport_id if given, otherwise adds one
+        If the command instance is passed its log is printed too, before
+        any error saving the CSVImport is raised
+    """
+    from ...models import CSVImport
     try:
-        if not instance:
-            from csvimport.models import CSVImport
+        if csvimport_id:
+            csvimp = CSVImport.objects.get(pk=csvimport_id)
+        else:
             csvimp = CSVImport()
         if props:
             for key, value in props.items():
                 setattr(csvimp, key, value)
         csvimp.save()
-        return csvimp.id
-    except:
-        # Running as command line
-        print 'Assumed charset = %s\n' % instance.charset
-        print '###############################\n'
-        for line in instance.loglist:
-            if type(line) != type(''):
-                for subline in line:
-                    print subline
+        csvimport_id = csvimp.id
+    finally:
+        if instance:
+            # Running as command line
+            print 'Assumed charset = %s\n' % instance.encoding_label()
+            print '###############################\n'
+            for line in instance.loglist:
+                if type(line) != type(''):
+                    for subline in line:
+                        print subline
+                        print
+                else:
+                    print line
                     print
-            else:
-                print line
-                print
+    return csvimport_id
 
 class Command(LabelCommand):
     """
@@ -67,10 +102,43 @@ class Command(LabelCommand):
     option_list = BaseCommand.option_list + (
                make_option('--mappings', default='',
                            help='Please provide the file to import from'),
+               make_option('--defaults', default='',
+                           help='Values set on every row, in the mappings format, eg. country=KE(Country|code)'),
                make_option('--model', default='iisharing.Item',
                            help='Please provide the model to import to'),
                make_option('--charset', default='',
-                           help='Force the charset conversion used rather than detect it')
+                           help='Force the charset conversion used rather than detect it'),
+               make_option('--sheet', default='',
+                           help='The worksheet of an xlsx file to import, by name or number, rather than the first'),
+               make_option('--batch-size', default=1, type='int',
+                           dest='batch_size',
+                           help='Insert new rows with the loader in batches of this size'),
+               make_option('--fk-cache-size', default=CSVIMPORT_FK_CACHE_SIZE,
+                           type='int', dest='fk_cache_size',
+                           help='Maximum number of related model instances to cache'),
+               make_option('--warm-cache', action='store_true', default=False,
+                           dest='warm_cache',
+                           help='Load the related model cache with one query before importing'),
+               make_option('--no-deduplicate', action='store_false', default=True,
+                           dest='deduplicate',
+                           help='Insert every row rather than updating matching rows'),
+               make_option('--workers', default=1, type='int',
+                           help='Import a file, or the files in a directory, in this many processes, without deduplication'),
+               make_option('--resume', default=None, type='int',
+                           help='Resume the unfinished import with this CSVImport id from its last checkpoint'),
+               make_option('--stats', action='store_true',
+                           default=CSVIMPORT_STATS,
+                           help='Log the time spent in each stage of the import and its query count'),
+               make_option('--error-file', default='', dest='error_file',
+                           help='Write every row error to this csv file, rather than only a sample of each kind'),
+               make_option('--upsert', action='store_true', default=False,
+                           help='Insert or update batches of rows with one statement, matching on the * marked unique fields or the primary key'),
+               make_option('--loader', default='', type='choice',
+                           choices=[''] + sorted(LOADERS),
+                           help='Write batches with this loader (%s) rather than the one for the database' % ', '.join(sorted(LOADERS))),
+               make_option('--commit-rows', default=CSVIMPORT_CHECKPOINT_ROWS,
+                           type='int', dest='commit_rows',
+                           help='Commit the import, and checkpoint it, after at least this many rows')
                    )
     help = "Imports a CSV file to a model"
 
@@ -88,14 +156,44 @@ class Command(LabelCommand):
         self.app_label = ''
         self.model = ''
         self.model_name = ''
-        self.fk_model = ''
-        self.fk_field = None
+        self.related = OrderedDict()
         self.fieldmap = {}
         self.file_name = ''
         self.nameindexes = False
         self.deduplicate = True
+        self.upsert = False
+        self.upserter = None
+        self.loader_name = ''
+        self.loader = None
+        self.db = None
+        self.commit_rows = CSVIMPORT_CHECKPOINT_ROWS
+        self.batch_size = 1
+        self.fk_cache_size = CSVIMPORT_FK_CACHE_SIZE
+        self.warm_cache = False
+        self.plan = None
+        self.workers = 1
+        self.options = {}
+        self.file_path = ''
+        self.directory = ''
+        self.importlist = []
+        self.rowcount = 0
+        self.checkpoint = True
+        self.checkpoint_row = 0
+        self.checkpoint_offset = 0
+        self.fingerprint = ''
+        self.stats = ImportStats()
+        self.progress = None
+        self.listening = set()
+        self.error_log = ErrorLog(CSVIMPORT_ERROR_SAMPLES, logger=logger)
+        self.resume_skip = 0
+        self.reader = None
+        self.member = None
+        self.sheet = ''
+        self.line_reader = None
         self.csvfile = []
+        self.header = None
         self.charset = ''
+        self.charset_examined = None
         self.unique_fields = list()
         self.unique_related_fields = list()
 
@@ -103,12 +201,8 @@ class Command(LabelCommand):
         """ Handle the circular reference by passing the nested
             save_csvimport function
         """
-        filename = label
-        mappings = options.get('mappings', [])
-        modelname = options.get('model', 'Item')
-        charset = options.get('charset', '')
-        # show_traceback = options.get('traceback', True)
-        self.setup(mappings, modelname, charset, filename)
+        setup_options = self.import_options(options)
+        self.setup(csvfile=label, **setup_options)
         if not hasattr(self.model, '_meta'):
             msg = 'Sorry your model could not be found please check app_label.modelname'
             try:
@@ -116,15 +210,70 @@ class Command(LabelCommand):
             except:
                 self.loglist.append(msg)
             return
-        errors = self.run()
+        # Add the log first so the import can checkpoint its progress to it
+        csvimport_id = setup_options['resume'] or save_csvimport(
+            self.import_props('', 'running'))
+        errors = self.run(logid=csvimport_id)
         if self.props:
-            save_csvimport(self.props, self)
+            save_csvimport(self.props, self, csvimport_id)
         self.loglist.extend(errors)
         return
 
+    def import_options(self, options):
+        """ The arguments of setup from the command line options """
+        return {'mappings': options.get('mappings', []),
+                'defaults': options.get('defaults', ''),
+                'modelname': options.get('model', 'Item'),
+                'charset': options.get('charset', ''),
+                'batch_size': options.get('batch_size', 1),
+                'fk_cache_size': options.get('fk_cache_size',
+                                             CSVIMPORT_FK_CACHE_SIZE),
+                'warm_cache': options.get('warm_cache', False),
+                'deduplicate': options.get('deduplicate', True),
+                'workers': options.get('workers', 1),
+                'resume': options.get('resume'),
+                'stats': options.get('stats', CSVIMPORT_STATS),
+                'error_file': options.get('error_file', ''),
+                'upsert': options.get('upsert', False),
+                'loader': options.get('loader', ''),
+                'commit_rows': options.get('commit_rows',
+                                           CSVIMPORT_CHECKPOINT_ROWS),
+                'sheet': options.get('sheet', '')}
+
     def setup(self, mappings, modelname, charset, csvfile='', defaults='',
-              uploaded=None, nameindexes=False, deduplicate=True):
-        """ Setup up the attributes for running the import """
+              uploaded=None, nameindexes=False, deduplicate=True,
+              batch_size=1, fk_cache_size=CSVIMPORT_FK_CACHE_SIZE,
+              warm_cache=False, workers=1, rows=None, resume=None,
+              stats=CSVIMPORT_STATS, progress=None, error_file='',
+              upsert=False, loader='',
+              commit_rows=CSVIMPORT_CHECKPOINT_ROWS, member=None, sheet=''):
+        """ Setup up the attributes for running the import
+            rows can be given rather than a file, as an iterable of
+            csv rows starting with the header
+            resume is the id of the CSVImport of an unfinished import of
+            the same file to continue from its last checkpoint
+            progress is called with the ImportStats periodically
+            error_file is a csv file to write every row error to
+            upsert writes batches with the database's insert or update
+            statement where it has one, rather than deduplicating
+            loader names the backend writing batches of new rows,
+            otherwise it is picked for the database
+            commit_rows is the least number of rows written in each
+            transaction, after which it is committed with a checkpoint
+            member is the csv file to import from a zip file
+            sheet is the worksheet of an xlsx file, by name or number
+        """
+        # Keep the options to setup the same import in worker processes
+        self.options = {'mappings': mappings, 'modelname': modelname,
+                        'defaults': defaults, 'nameindexes': nameindexes,
+                        'deduplicate': deduplicate, 'batch_size': batch_size,
+                        'fk_cache_size': fk_cache_size,
+                        'warm_cache': warm_cache, 'stats': stats,
+                        'upsert': upsert, 'loader': loader,
+                        'commit_rows': commit_rows, 'sheet': sheet}
+        self.stats = ImportStats(stats, CSVIMPORT_PROGRESS_SECONDS)
+        self.progress = progress
+        self.error_log = ErrorLog(CSVIMPORT_ERROR_SAMPLES, error_file, logger)
         self.defaults = self.__mappings(defaults)
         
         # Retrieve the app label and model name
@@ -136,12 +285,10 @@ class Command(LabelCommand):
         self.charset = charset
         self.app_label = app_label
         self.model = models.get_model(app_label, model)
+        self.db = router.db_for_write(self.model)
 
-        # Construct the field map of the main model
-        for field in self.model._meta.fields:
-            self.fieldmap[field.name] = field
-            if field.__class__ == models.ForeignKey:
-                self.fieldmap[field.name+"_id"] = field
+        # The field map of the main model, shared by imports of the model
+        self.fieldmap = field_map(self.model)
 
         # If we have custom mappings, determine the format
         if mappings:
@@ -153,13 +300,64 @@ class Command(LabelCommand):
         # Store additional settings
         self.nameindexes = bool(nameindexes)
         self.file_name = csvfile
+        self.member = member
+        self.sheet = sheet or ''
+        if member:
+            self.file_name = '%s:%s' % (csvfile, member)
         self.deduplicate = deduplicate
+        self.upsert = bool(upsert)
+        self.loader_name = loader or ''
+        self.commit_rows = max(int(commit_rows or 1), 1)
+        self.batch_size = max(int(batch_size or 1), 1)
+        self.fk_cache_size = int(fk_cache_size)
+        self.warm_cache = bool(warm_cache)
+        self.workers = max(int(workers or 1), 1)
 
         # Retrieve file
-        if uploaded:
-            self.csvfile = self.__csvfile(uploaded.path)
+        if rows is not None:
+            self.set_rows(rows)
+        elif os.path.isdir(csvfile) and not uploaded:
+            # Each file is imported separately by run
+            self.directory = csvfile
+        elif member is None and self.zip_sources(csvfile, uploaded):
+            # As is each csv file of a zip file
+            self.directory = uploaded and uploaded.path or csvfile
         else:
-            self.check_filesystem(csvfile)
+            if uploaded:
+                self.file_path = uploaded.path
+            elif os.path.isfile(csvfile):
+                self.file_path = csvfile
+            offset = 0
+            if self.file_path:
+                self.fingerprint = file_fingerprint(self.file_path)
+                if resume:
+                    offset = self.resume(resume)
+            if uploaded:
+                self.set_rows(self.__csvfile(uploaded.path, offset))
+            else:
+                self.check_filesystem(csvfile, offset)
+        self.options['charset'] = self.charset
+
+    def zip_sources(self, csvfile, uploaded=None):
+        """ Is the file a zip of more than one csv file """
+        if uploaded:
+            csvfile = uploaded.path
+        return os.path.isfile(csvfile) and len(csv_sources(csvfile)) > 1
+
+    def resume(self, csvimport_id):
+        """ Start from the last checkpoint of an unfinished import
+            Returns the byte offset to read the file from
+        """
+        from ...models import CSVImport
+        csvimp = CSVImport.objects.get(pk=csvimport_id)
+        if csvimp.fingerprint != self.fingerprint:
+            raise Exception('Cannot resume import %s since %s has changed'
+                            % (csvimport_id, self.file_path))
+        self.checkpoint_row = csvimp.checkpoint_row
+        self.checkpoint_offset = csvimp.checkpoint_offset
+        # Without an offset the committed rows are read and skipped
+        self.resume_skip = self.checkpoint_row
+        return self.checkpoint_offset
 
     def check_fkey(self, key, field):
         """ Build fkey mapping via introspection of models """
@@ -170,34 +368,55 @@ class Command(LabelCommand):
                                     field.related.parent_model._meta.fields[1].name,)
         return key
 
-    def check_filesystem(self, csvfile):
+    def check_filesystem(self, csvfile, offset=0):
         """ Check for files on the file system """
-        if os.path.exists(csvfile):
-            if os.path.isdir(csvfile):
-                self.csvfile = []
-                for afile in os.listdir(csvfile):
-                    if afile.endswith('.csv'):
-                        filepath = os.path.join(csvfile, afile)
-                        try:
-                            lines = self.__csvfile(filepath)
-                            self.csvfile.extend(lines)
-                        except:
-                            pass
-            else:
-                self.csvfile = self.__csvfile(csvfile)
-        if not getattr(self, 'csvfile', []):
+        rows = iter([])
+        if os.path.isfile(csvfile):
+            rows = self.__csvfile(csvfile, offset)
+        self.set_rows(rows)
+        if self.header is None:
             raise Exception('File %s not found' % csvfile)
 
+    def set_rows(self, rows):
+        """ Peek the header row and leave the rest of the rows streaming
+            so only one row at a time is held in memory
+        """
+        rows = iter(rows)
+        self.header = next(rows, None)
+        if self.header is None:
+            self.csvfile = rows
+        else:
+            self.csvfile = itertools.chain([self.header], rows)
+
     def run(self, logid=0):
         """ Run the csvimport """
+        if self.directory:
+            return self.run_directory(logid)
+        if self.workers > 1:
+            return self.run_parallel(logid)
         loglist = []
-        importlist = []
-
-        # If we have named indexes, assume the first
-        # row of the csv is a header
-        if self.nameindexes:
-            indexes = self.csvfile.pop(0)
-        counter = 0
+        self.importlist = importlist = []
+        # Rows waiting to be deduplicated and saved
+        batch = []
+
+        # The header row is always skipped, and if we have named indexes
+        # it is also used to find the columns
+        rows = iter(self.csvfile)
+        next(rows, None)
+        header = self.header or []
+        counter = self.checkpoint_row
+        # Skip the rows before the checkpoint, which like counter does
+        # not count blank lines
+        skip = self.resume_skip
+        while skip:
+            row = next(rows, None)
+            if row is None:
+                break
+            if row:
+                skip -= 1
+        stats = self.stats
+        stats.start()
+        rows = stats.timed_rows(rows)
 
         # Set the import id if present
         if logid:
@@ -205,32 +424,16 @@ class Command(LabelCommand):
         else:
             csvimportid = 0
 
-        # If we are using custom mapings, retrieve any related models
-        # Only one related model is currently supported
+        # We may be using custom mapings
         if self.mappings:
             loglist.append('Using manually entered mapping list')
 
             self.custom_mappings = True
 
-            for custom_mapping in self.mappings:
-                if custom_mapping[2]: # Non-foreign keys have None here
-                    fk_key = custom_mapping[2][0]
-                    required_fkey = custom_mapping[1]
-                    break # Assuming just one foreign key for now.  
-
-            # Get the related model appp label, if different
-            try:
-                new_app_label = ContentType.objects.get(model__iexact=fk_key).app_label
-            except:
-                new_app_label = self.app_label
-
-            # Store the related model itself
-            self.fk_model = models.get_model(new_app_label, fk_key)
-
         # No custom mappings, so retrieve the mappings from the first row
         # of the csv file
         else:
-            mappingstr = self.parse_header(self.csvfile[0])
+            mappingstr = self.parse_header(header)
             if mappingstr:
                 loglist.append('Using mapping from first row of CSV file')
                 self.mappings = self.__mappings(mappingstr)
@@ -241,248 +444,510 @@ class Command(LabelCommand):
                                    - you must add a header field name row
                                    to the CSV file or supply a mapping list''' %
                                 (self.model._meta.app_label, self.model.__name__))
+            stats.stop()
             return loglist
 
-        # Process each additional row in the file
-        for row in self.csvfile[1:]:
-            # Update the logger
-            if CSVIMPORT_LOG == 'logger':
-                logger.info("Import %s %i", self.model.__name__, counter)
-            counter += 1
-
-            model_instance = None
-            main_model_fields = dict()
-            related_model_instance = None
-            related_model_fields = dict()
-
-            # process each field in the mappings
-            for (column, field, foreignkey) in self.mappings:
-                field_type = self.fieldmap.get(field).get_internal_type()
-
-                # either proceed in order or use the indexes to find
-                # the right column
-                if self.nameindexes:
-                    column = indexes.index(column)
-                else:
-                    column = int(column)-1
-
-                # Strip out unecessary spaces if needed
-                try:
-                    row[column] = row[column].strip()
-                except AttributeError:
-                    pass
-
-                # Log this mapping
-                if self.debug:
-                    loglist.append('%s.%s = "%s"' % (self.model.__name__,
-                                                          field, row[column]))
-                # Tidy up boolean data
-                if field_type in BOOLEAN:
-                    row[column] = row[column] in BOOLEAN_TRUE
-
-                # Tidy up numeric data
-                if field_type in NUMERIC:
-                    if not row[column]:
-                        row[column] = 0
-                    else:
-                        try:
-                            row[column] = float(row[column])
-                        except:
-                            loglist.append('Column %s = %s is not a number so is set to 0' \
-                                                % (field, row[column]))
-                            row[column] = 0
-                    if field_type in INTEGER:
-                        if row[column] > 9223372036854775807:
-                            loglist.append('Column %s = %s more than the max integer 9223372036854775807' \
-                                                % (field, row[column]))
-                        if str(row[column]).lower() in ('nan', 'inf', '+inf', '-inf'):
-                            loglist.append('Column %s = %s is not an integer so is set to 0' \
-                                                % (field, row[column]))
-                            row[column] = 0
-                        row[column] = int(row[column])
-                        if row[column] < 0 and field_type.startswith('Positive'):
-                            loglist.append('Column %s = %s, less than zero so set to 0' \
-                                                % (field, row[column]))
-                            row[column] = 0
-
-                # Tidy up date data, for now only accepting 'YYYY-MM-DD' format
-                if field_type in DATEFIELD:
-                    from datetime import datetime
-
-                    try:
-                        row[column] = datetime.strptime(row[column], '%Y-%m-%d')
-                    except:
-                        row[column] = None
-                
-                # Store the value in the appropriate field dictionary
-                if row[column] != '':
-                    if foreignkey:
-                        related_model, related_field = foreignkey
-                        related_model_fields[related_field] = row[column]
-                        self.fk_field = field
-                    else:
-                        main_model_fields[field] = row[column]
-
-            #if self.defaults:
-            #    for (field, value, foreignkey) in self.defaults:
-            #        try:
-            #            done = model_instance.getattr(field)
-            #        except:
-            #            done = False
-            #        if not done:
-            #            if foreignkey:
-            #                value = self.insert_fkey(foreignkey, value)
-            #            model_instance.__setattr__(field, value)
-
-            # Send presave signal
-            importing_csv.send(sender=self.model,
-                               instance=model_instance,
-                               row=dict(zip(self.csvfile[:1][0], row)))
-
-            related_model_saved = False
-
-            # First the related model
-            if self.deduplicate:
-                matchdict = {}
-                full_match = True
-                related_model_created = False
-
-                # Determine if we are doing a full field match
-                # or only a subset of fields
-                if len(self.unique_related_fields) > 0:
-                    # Match on specified fields
-                    full_match = False
-                    for field in self.unique_related_fields:
-                        matchdict[field] = related_model_fields[field]                   
-                else:
-                    # Match on all foreign key fields
-                    for (column, field, foreignkey) in self.mappings:
-                        if foreignkey:
-                            matchdict[foreignkey[1]] = related_model_fields[field]
-
-                # Retrieve model if it exists, otherwise create it
-                try:
-                    related_model_instance = self.fk_model.objects.get(**matchdict)
-                except self.fk_model.DoesNotExist:
-                    related_model_instance = self.fk_model(**related_model_fields)
-                    related_model_created = True
-
-                except self.fk_model.MultipleObjectsReturned:
-                    related_model_instance = self.fk_model.objects.filter(**matchdict)[0]
-
-                # If an existing model was found, updated it with the new data
-                if not related_model_created:    
-                    for field, value in related_model_fields.iteritems():
-                        setattr(related_model_instance, field, value)
-    
-            # Not doing deduplication
-            else:
-                related_model_created = True
-                related_model_instance = self.fk_model(**related_model_fields)
-    
-            # Store the import id for later and save the model
-            related_model_instance.csvimport_id = csvimportid
+        # Rows are matched to existing instances on the unique fields if
+        # any were marked with *, otherwise all the mapped fields
+        if self.unique_fields:
+            match_fields = self.unique_fields
+        else:
+            match_fields = [field for (column, field, foreignkey)
+                            in self.mappings]
+        self.dedup_index = DeduplicateIndex(self.model, match_fields)
+        self.upserter = None
+        if self.upsert:
+            self.upserter = self.get_upserter(loglist)
+        self.loader, reason = get_loader(self.model, self.loader_name,
+                                         self.deduplicate and match_fields
+                                         or ())
+        if reason:
+            loglist.append('Using the %s loader since %s' % (
+                self.loader.__class__.__name__, reason))
+
+        # Resolve the columns and converters once rather than per cell
+        self.plan = ImportPlan(self.mappings, self.fieldmap, header,
+                               self.nameindexes, self.debug,
+                               self.model.__name__, self.defaults,
+                               typed=isinstance(self.reader, XLSXReader))
+
+        # The related instances of each foreign key are resolved per batch
+        # and cached by their match fields, the * marked related fields
+        # or else all of the mapped ones
+        self.related = OrderedDict()
+        for field, model_name in self.plan.related.items():
+            related_fields = self.plan.related_fields(field)
+            match_fields = [name for name in related_fields
+                            if name in self.unique_related_fields]
+            resolver = RelatedResolver(self.related_model(model_name),
+                                       match_fields or related_fields,
+                                       self.fk_cache_size, self.deduplicate,
+                                       self.db)
+            if self.warm_cache and self.deduplicate:
+                resolver.cache.warm(related_fields)
+            self.related[field] = resolver
+        if self.plan.date_columns:
+            # Rows read ahead must be within the first checkpoint so its
+            # byte offset is after them
+            sample = list(itertools.islice(rows, min(CSVIMPORT_DATE_SAMPLE,
+                                                     self.commit_rows)))
+            self.plan.infer(sample)
+            rows = itertools.chain(sample, rows)
+
+        # Rows are only made into dictionaries for signal receivers
+        self.listening = set([signal for signal in (importing_csv,
+                                                    imported_csv,
+                                                    importing_csv_batch,
+                                                    imported_csv_batch)
+                              if signal.has_listeners(self.model)])
+        row_dicts = bool(self.listening)
+
+        # Rows are written in transactions of commit_rows rows, each
+        # committed along with its checkpoint
+        committed = counter
+        with CommitGroups(self.db) as commits:
+            # Process each additional row in the file
+            for row in rows:
+                # Skip blank lines
+                if not row:
+                    stats.skipped += 1
+                    continue
+
+                counter += 1
+                self.rowcount = counter
+                self.error_log.row = counter
+                stats.rows += 1
+
+                # Convert the mapped cells using the plan
+                with stats.timer('convert'):
+                    main_model_fields, related = self.plan.apply(
+                        row, self.error_log)
+
+                #if self.defaults:
+                #    for (field, value, foreignkey) in self.defaults:
+                #        try:
+                #            done = model_instance.getattr(field)
+                #        except:
+                #            done = False
+                #        if not done:
+                #            if foreignkey:
+                #                value = self.insert_fkey(foreignkey, value)
+                #            model_instance.__setattr__(field, value)
+
+                rowdict = None
+                if row_dicts:
+                    rowdict = dict(zip(header, row))
+
+                # Send presave signal
+                if importing_csv in self.listening:
+                    with stats.timer('signals'):
+                        importing_csv.send(sender=self.model,
+                                           instance=None,
+                                           row=rowdict)
+
+                # Queue the row and write the batch when it is full
+                batch.append((main_model_fields, related, rowdict, counter))
+                if len(batch) >= self.batch_size:
+                    self.save_batch(batch, csvimportid, importlist)
+                    batch = []
+                    if counter - committed >= self.commit_rows:
+                        self.save_checkpoint(csvimportid, counter)
+                        commits.commit()
+                        committed = counter
+                    if stats.progress_due():
+                        self.report_progress()
+
+            # Write any remaining queued rows
+            self.save_batch(batch, csvimportid, importlist)
+            self.save_checkpoint(csvimportid, counter)
+        stats.stop()
+        self.error_log.close()
+        self.report_progress()
+        if self.reader and self.reader.decode_errors:
+            loglist.append('Replaced the bytes that are not valid %s in %s '
+                           'rows' % (self.charset, self.reader.decode_errors))
+        summary = []
+        if stats.timed:
+            summary.extend(stats.summary())
+        if self.deduplicate:
+            summary.extend([resolver.cache.summary()
+                            for resolver in self.related.values()])
+        if CSVIMPORT_LOG == 'logger':
+            # The sample error messages were logged as they were added
+            for line in loglist + self.error_log.lines(samples=False) + summary:
+                logger.info(line)
+        loglist.extend(self.error_log.lines())
+        loglist.extend(summary)
+        self.loglist.extend(loglist)
 
-            # Save the model instance
-            try:
-                related_model_instance.save()
-            except DatabaseError, err:
-                loglist.append('Database Error: {0}'.format(err))
-
-            # Ensure that the foreign key field is populated with
-            # the correct related_model_instance
-            if self.fk_field:
-                main_model_fields[self.fk_field] = related_model_instance
+        if self.loglist:
+            self.props = self.import_props('\n'.join(self.loglist))
+            return self.loglist
+        else:
+            return ['No logging', ]
+
+    def get_upserter(self, loglist):
+        """ The Upsert writing batches for the model, matching rows on
+            the unique fields marked with * or else a mapped primary key
+            Returns None, and logs why, if it cannot be used
+        """
+        mapped = [field for (column, field, foreignkey) in self.mappings]
+        conflict_fields = self.unique_fields
+        if not conflict_fields and self.model._meta.pk.name in mapped:
+            conflict_fields = [self.model._meta.pk.name]
+        upserter, reason = Upsert.for_model(self.model, conflict_fields,
+                                            mapped)
+        if upserter is None:
+            loglist.append('Not using upsert since %s' % reason)
+        return upserter
+
+    def report_progress(self):
+        """ Log the rows imported so far and call the progress callback """
+        if CSVIMPORT_LOG == 'logger':
+            logger.info('Import %s: %s rows, %.1f rows per second',
+                        self.model.__name__, self.rowcount,
+                        self.stats.rows_per_second())
+        if self.progress:
+            self.progress(self.stats)
+
+    def related_model(self, name):
+        """ The related model with a name, from its app if different """
+        return related_model(name, self.app_label)
+
+    def resolve_related(self, batch, csvimportid):
+        """ Find or create the related model instances of each foreign
+            key for a batch of rows, and set them in the main model fields
+            so they are then part of the main model deduplication match
+        """
+        for field, resolver in self.related.items():
+            instances = resolver.resolve([related.get(field)
+                                          for fields, related, row, number
+                                          in batch],
+                                         csvimportid, self.related_failed)
+            for (fields, related, row, number), instance in zip(batch,
+                                                                 instances):
+                if instance is not None:
+                    fields[field] = instance
+
+    def related_failed(self, instance, err):
+        """ Log a related model instance that could not be saved """
+        self.error_log.add(None, DATABASE, 'Database Error: {0}'.format(err))
+        self.stats.errors += 1
+
+    def save_checkpoint(self, csvimportid, row):
+        """ Record the number of the last saved row, and the byte offset
+            of the file after it, on the CSVImport log along with the
+            import progress
+        """
+        if not self.checkpoint or not isinstance(csvimportid, (int, long)):
+            return
+        from ...models import CSVImport
+        self.checkpoint_row = row
+        if self.line_reader:
+            self.checkpoint_offset = self.line_reader.offset
+        CSVImport.objects.filter(pk=csvimportid).update(
+            checkpoint_row=self.checkpoint_row,
+            checkpoint_offset=self.checkpoint_offset,
+            fingerprint=self.fingerprint,
+            rows_processed=row,
+            rows_per_second=self.stats.rows_per_second())
+
+    def save_batch(self, batch, csvimportid, importlist):
+        """ Save a batch of rows, each a dictionary of main model field
+            values and the csv row as a dictionary.
+            With deduplication the existing instances for the whole batch
+            are found with one query, then updated if their values changed.
+            New instances are saved, or written by the loader when
+            the batch size is more than one.
+        """
+        if not batch:
+            return
+        if self.related:
+            with self.stats.timer('related'):
+                self.resolve_related(batch, csvimportid)
+        if self.upserter:
+            return self.upsert_batch(batch, csvimportid, importlist)
+        stats = self.stats
+        keys = [None] * len(batch)
+        existing = {}
+        if self.deduplicate:
+            with stats.timer('dedup'):
+                keys = [self.dedup_index.key(fields)
+                        for fields, related, row, number in batch]
+                existing = self.dedup_index.existing(keys)
+
+        instances = []
+        created = []
+        saves = []
+        new = []
+        numbers = {}
+        for (fields, related, row, number), key in zip(batch, keys):
+            instance = existing.get(key)
+            if instance is None:
+                instance = self.model(**fields)
+                if key:
+                    # Later rows in the batch update this new instance
+                    existing[key] = instance
+                new.append(instance)
+                saves.append(instance)
+                created.append(True)
             else:
-                raise Exception('No fk_field is set.')
-
-            # If the related model already exists
-            # get the associated main model instead of creating it
-            # then update with new values
-            if not related_model_created:
-                query = dict()
-                query[self.fk_field] = related_model_instance
-
-                try:
-                    model_instance = self.model.objects.get(**query)
-                except self.model.DoesNotExist:
-                    model_instance = None
-                except self.model.MultipleObjectsReturned:
-                    model_instance = self.model.objects.filter(**query)[0]
-
-            # No main model was found for the existing related model instance,
-            # or the related_model instance was new
-            created = False
-            if not model_instance:
-                if self.deduplicate:
-                    matchdict = {}
-                    full_match = True
-
-                    # if we have unique fields, use only those for matching,
-                    # otherwise use all fields
-                    if len(self.unique_fields) > 0:
-                        full_match = False
-                        for field in self.unique_fields:
-                            try:
-                                matchdict[field] = main_model_fields[field]
-                            except KeyError:
-                                continue
-                    else: # Match on all fields
-                        for (column, field, foreignkey) in self.mappings:
-                            try:
-                                matchdict[field] = main_model_fields[field]
-                            except KeyError:
-                                continue
-
-                    try:
-                        model_instance = self.model.objects.get(**matchdict)
-                    except self.model.DoesNotExist:
-                        created = True
-                        model_instance = self.model(**main_model_fields)
-
-                    if not created:
-                        for field, value in main_model_fields.iteritems():
-                            setattr(model_instance, field, value)
+                if self.dedup_index.update(instance, fields):
+                    stats.updated += 1
+                    if instance not in saves:
+                        saves.append(instance)
                 else:
-                    model_instance = self.model(**main_model_fields)
-
-            model_instance.csvimport_id = csvimportid
+                    stats.unchanged += 1
+                created.append(False)
+            instance.csvimport_id = csvimportid
+            instances.append(instance)
+            numbers[id(instance)] = number
+        rows = [row for fields, related, row, number in batch]
+
+        if importing_csv_batch in self.listening:
+            with stats.timer('signals'):
+                importing_csv_batch.send(sender=self.model,
+                                         rows=zip(rows, instances, created))
+
+        with stats.timer('save'):
+            new = set([id(instance) for instance in new])
+            failed = self.write_batch(saves, numbers,
+                                      lambda part: self.write_instances(part,
+                                                                        new))
+            stats.created += len(new - failed)
+
+        with stats.timer('signals'):
+            if imported_csv in self.listening:
+                for row, instance, was_created in zip(rows, instances,
+                                                      created):
+                    # Send post-save signal
+                    imported_csv.send(sender=self.model,
+                                      created=was_created,
+                                      instance=instance,
+                                      row=row)
+            if imported_csv_batch in self.listening:
+                imported_csv_batch.send(sender=self.model,
+                                        rows=zip(rows, instances, created))
+
+        # add pk to list if it saved properly
+        # (only some loaders and backends return the pks)
+        importlist.extend([instance.pk for instance in instances
+                           if instance.pk])
+        stats.count_queries()
+
+    def write_batch(self, instances, numbers, write):
+        """ Write the instances of a batch in a savepoint, splitting the
+            batch to find and log the rows that fail if it cannot be written
+            numbers maps the id of each instance to its row number
+            Returns the set of ids of the instances that failed
+        """
+        failures = set()
+        if not instances:
+            return failures
+
+        def failed(instance, err):
+            failures.add(id(instance))
+            self.error_log.row = numbers[id(instance)]
+            self.error_log.add(None, DATABASE,
+                               'Database Error: {0}'.format(err))
+            self.stats.errors += 1
+
+        write_bisecting(instances, write, failed, self.db)
+        return failures
+
+    def write_instances(self, instances, new):
+        """ Write the new instances, those with ids in new, with the loader
+            when batching, and save the rest
+        """
+        bulk = self.batch_size > 1
+        if bulk:
+            loads = [instance for instance in instances if id(instance) in new]
+            if loads:
+                self.loader.load(loads)
+        for instance in instances:
+            if bulk and id(instance) in new:
+                continue
+            # New rows skip the update that is tried first when
+            # the primary key is set, as it is for natural keys
+            instance.save(force_insert=instance._state.adding)
+
+    def upsert_batch(self, batch, csvimportid, importlist):
+        """ Insert or update a batch of rows with the database's upsert
+            Whether each row was created is not known, so the signals
+            are sent with created None. The statement does not return
+            the primary keys, so only rows with a mapped primary key
+            have one, and are added to the importlist.
+        """
+        stats = self.stats
+        instances = []
+        # A row may only be upserted once per statement, so later rows
+        # in the batch with the same unique values replace earlier ones
+        unique = {}
+        numbers = {}
+        for fields, related, row, number in batch:
+            instance = self.model(**fields)
+            instance.csvimport_id = csvimportid
+            instances.append(instance)
+            numbers[id(instance)] = number
+            key = self.dedup_index.key(fields)
+            if key and len(key[0]) == len(self.upserter.conflict):
+                unique[key] = instance
+            else:
+                unique[id(instance)] = instance
+        created = [None] * len(instances)
+        rows = [row for fields, related, row, number in batch]
+
+        if importing_csv_batch in self.listening:
+            with stats.timer('signals'):
+                importing_csv_batch.send(sender=self.model,
+                                         rows=zip(rows, instances, created))
+
+        with stats.timer('save'):
+            kept = set([id(instance) for instance in unique.values()])
+            writes = [instance for instance in instances
+                      if id(instance) in kept]
+            failed = self.write_batch(writes, numbers, self.upserter.load)
+            stats.upserted += len(writes) - len(failed)
+
+        with stats.timer('signals'):
+            if imported_csv in self.listening:
+                for row, instance in zip(rows, instances):
+                    imported_csv.send(sender=self.model, created=None,
+                                      instance=instance, row=row)
+            if imported_csv_batch in self.listening:
+                imported_csv_batch.send(sender=self.model,
+                                        rows=zip(rows, instances, created))
+        importlist.extend([instance.pk for instance in writes
+                           if instance.pk and id(instance) not in failed])
+        stats.count_queries()
+
+    def run_parallel(self, logid=0):
+        """ Run the import of a single file in worker processes, each
+            importing a byte range of the file, then merge their logs
+        """
+        reason = ''
+        if self.deduplicate:
+            reason = 'deduplication is on'
+        elif not self.file_path:
+            reason = 'the import is not from a single file'
+        elif isinstance(self.reader, XLSXReader):
+            reason = 'the file is an xlsx workbook'
+        elif self.reader and self.reader.compression:
+            reason = 'the file is %s compressed' % self.reader.compression
+        elif not ascii_compatible(self.charset):
+            reason = 'the charset is %s' % self.charset
+        elif self.resume_skip:
+            reason = 'the checkpoint has no byte offset'
+        if reason:
+            self.workers = 1
+            self.run(logid)
+            self.loglist.insert(0, 'Imported in one process since %s' % reason)
+            return self.loglist
 
-            # Save the model            
+        self.stats.start()
+        # A resumed import splits the rest of the file after its checkpoint
+        ranges = record_boundaries(self.file_path, self.workers,
+                                   self.checkpoint_offset)
+        tasks = [(self.options, self.file_path, start, end, self.header, logid)
+                 for start, end in ranges]
+
+        # Workers must not share the parent's database connection
+        close_connection()
+        pool = multiprocessing.Pool(min(self.workers, len(tasks)),
+                                    initializer=close_connection)
+        try:
+            results = pool.map(import_range, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.importlist = []
+        self.rowcount = 0
+        decode_errors = 0
+        for result in results:
+            self.loglist.extend(result['loglist'])
+            self.importlist.extend(result['importlist'])
+            self.rowcount += result['rows']
+            decode_errors += result['decode_errors']
+            self.stats.merge(result['stats'])
+        self.stats.stop()
+        if decode_errors:
+            self.loglist.append('Replaced the bytes that are not valid %s in '
+                                '%s rows' % (self.charset, decode_errors))
+        self.loglist.append('Imported %s rows with %s workers' % (
+                            self.rowcount, len(tasks)))
+        if self.stats.timed:
+            self.loglist.extend(self.stats.summary())
+        self.props = self.import_props('\n'.join(self.loglist))
+        return self.loglist
+
+    def run_directory(self, logid=0):
+        """ Import each csv file in a directory, or zip file, separately,
+            with its own header and CSVImport log, in worker processes if
+            there are several workers and deduplication is off
+        """
+        tasks = [(self.options, path, member)
+                 for path, member in csv_sources(self.directory)]
+        if not tasks:
+            raise Exception('No csv files found in %s' % self.directory)
+
+        self.stats.start()
+        if self.workers > 1 and not self.deduplicate:
+            close_connection()
+            pool = multiprocessing.Pool(min(self.workers, len(tasks)),
+                                        initializer=close_connection)
             try:
-                model_instance.save()
-            except DatabaseError, err:
-                loglist.append('Database Error: {0}'.format(err))
-
-            # Send post-save signal    
-            imported_csv.send(sender=self.model,
-                              created=created,
-                              instance=model_instance,
-                              row=dict(zip(self.csvfile[:1][0], row)))
-
-            # add pk to list if it saved properly
-            if model_instance.pk:
-                importlist.append(model_instance.pk)
-
-            if CSVIMPORT_LOG == 'logger':
-                for line in loglist:
-                    logger.info(line)
-
-            self.loglist.extend(loglist)
-            loglist = []
-
-        if self.loglist:
-            # For some reason this is required here too
-            from datetime import datetime
-            self.props = {'file_name':self.file_name,
-                          'import_user':'cron',
-                          'upload_method':'cronjob',
-                          'error_log':'\n'.join(loglist),
-                          'import_date':datetime.now(),
-                          'import_list':importlist}
-            return self.loglist
+                results = pool.map(import_file, tasks)
+            finally:
+                pool.close()
+                pool.join()
         else:
-            return ['No logging', ]
+            if self.workers > 1:
+                self.loglist.append('Imported the files one at a time since deduplication is on')
+            results = [import_file(task) for task in tasks]
+
+        self.importlist = []
+        self.rowcount = 0
+        failed = 0
+        for result in results:
+            if result['failed']:
+                failed += 1
+            self.importlist.extend(result['importlist'])
+            self.rowcount += result['rows']
+            self.stats.merge(result['stats'])
+            self.loglist.append('%s: %s rows, %s log lines, CSVImport %s' % (
+                                result['file_name'], result['rows'],
+                                len(result['loglist']), result['csvimport_id']))
+            self.loglist.extend(['%s: %s' % (result['file_name'], line)
+                                 for line in result['loglist']
+                                 if result['failed']])
+        self.stats.stop()
+        self.loglist.append('Imported %s rows from %s files, %s failed' % (
+                            self.rowcount, len(results), failed))
+        if self.stats.timed:
+            self.loglist.extend(self.stats.summary())
+        self.props = self.import_props('\n'.join(self.loglist))
+        return self.loglist
+
+    def import_props(self, error_log, status='done'):
+        """ The properties of the CSVImport log of this import """
+        return {'file_name':self.file_name,
+                'import_user':'cron',
+                'upload_method':'cronjob',
+                'error_log':error_log,
+                'encoding':self.encoding_label(),
+                'import_date':datetime.now(),
+                'import_list':self.importlist,
+                'status':status,
+                'rows_processed':self.rowcount,
+                'stats':self.stats_json()}
+
+    def stats_json(self):
+        """ The stats and error counts of the import as json """
+        stats = self.stats.as_dict()
+        if self.error_log.counts:
+            stats['error_counts'] = self.error_log.as_dict()
+        return json.dumps(stats)
 
     def parse_header(self, headlist):
         """ Parse the list of headings and match with self.fieldmap """
@@ -518,34 +983,32 @@ class Command(LabelCommand):
         elif self.debug == True:
             print "%s: %s" % (types[type][0], message)
 
-    def __csvfile(self, datafile):
-        """ Detect file encoding and open appropriately """
-        filehandle = open(datafile)
-        if not self.charset:
-            diagnose = chardet.detect(filehandle.read())
-            self.charset = diagnose['encoding']
+    def __csvfile(self, datafile, offset=0):
+        """ Detect file encoding and read its rows with a CSVReader, or
+            an XLSXReader for an Excel workbook
+            If a byte offset is given the header row is followed by
+            the rows from that offset
+        """
         try:
-            csvfile = codecs.open(datafile, 'r', self.charset)
+            self.reader = open_reader(datafile, self.charset, offset,
+                                      CSVIMPORT_CHARSET_SAMPLE, self.member,
+                                      self.sheet)
         except IOError:
             self.error('Could not open specified csv file, %s, or it does not exist' % datafile, 0)
-        else:
-            # CSV Reader returns an iterable, but as we possibly need to
-            # perform list commands and since list is an acceptable iterable,
-            # we'll just transform it.
-            return list(self.charset_csv_reader(csv_data=csvfile,
-                                                charset=self.charset))
-
-    def charset_csv_reader(self, csv_data, dialect=csv.excel,
-                           charset='utf-8', **kwargs):
-        csv_reader = csv.reader(self.charset_encoder(csv_data, charset),
-                                dialect=dialect, **kwargs)
-        for row in csv_reader:
-            # decode charset back to Unicode, cell by cell:
-            yield [unicode(cell, charset) for cell in row]
-
-    def charset_encoder(self, csv_data, charset='utf-8'):
-        for line in csv_data:
-            yield line.encode(charset)
+        self.charset = self.reader.charset
+        if self.reader.examined is not None:
+            self.charset_examined = self.reader.examined
+        # Only the raw bytes of ASCII compatible charsets have row offsets
+        self.line_reader = self.reader.lines
+        if offset and self.line_reader:
+            self.resume_skip = 0
+        return self.reader
+
+    def encoding_label(self):
+        """ The charset used and how many bytes were read to detect it """
+        if self.charset_examined is None:
+            return self.charset
+        return ('%s (%s bytes)' % (self.charset, self.charset_examined))[:32]
 
     def __mappings(self, mappings):
         """
@@ -553,70 +1016,11 @@ class Command(LabelCommand):
         """
         if not mappings:
             return []
-
-        def parse_mapping(args):
-            """
-            Parse the custom mapping syntax (column1=field1(ForeignKey|field),
-            etc.)
-
-            >>> parse_mapping('a=b(c|d)')
-            [('a', 'b', '(c|d)')]
-
-            * indicates that this field should be used for deduplication
-
-            """
-
-            pattern = re.compile(r'(\*?\w+)=(\w+)(\(\w+\|\w+\))?')
-            mappings = pattern.findall(args)
-
-            mappings = list(mappings)
-            for mapping in mappings:
-                mapp = mappings.index(mapping)
-
-                mappings[mapp] = list(mappings[mapp])
-
-                # parse foreign key component
-                mappings[mapp][2] = parse_foreignkey(mapping[2])
-
-                # * indicates that this model field should be used for
-                # deduplication
-                if mappings[mapp][0].startswith('*'):
-                    mappings[mapp][0] = mappings[mapp][0][1:]
-
-                    related_field = mappings[mapp][2]
-
-                    if related_field:
-                        self.unique_related_fields.append(related_field[1])
-                    else:
-                        self.unique_fields.append(mappings[mapp][1])
-
-                mappings[mapp] = tuple(mappings[mapp])
-            mappings = list(mappings)
-            
-            return mappings
-
-        def parse_foreignkey(key):
-            """
-            Parse the foreignkey syntax (Key|field)
-
-            >>> parse_foreignkey('(a|b)')
-            ('a', 'b')
-            """
-
-            pattern = re.compile(r'(\w+)\|(\w+)', re.U)
-            if key.startswith('(') and key.endswith(')'):
-                key = key[1:-1]
-
-            found = pattern.search(key)
-
-            if found != None:
-                return (found.group(1), found.group(2))
-            else:
-                return None
-
-        mappings = mappings.replace(',', ' ')
-        mappings = mappings.replace('column', '')
-        return parse_mapping(mappings)
+        mappings, unique_fields, unique_related_fields = \
+            parse_mappings(mappings)
+        self.unique_fields.extend(unique_fields)
+        self.unique_related_fields.extend(unique_related_fields)
+        return list(mappings)
 
 
 class FatalError(Exception):
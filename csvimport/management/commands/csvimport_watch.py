@@ -0,0 +1,109 @@
+# Import the files dropped in a folder
+import multiprocessing
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .csvimport import Command as ImportCommand
+
+
+class Command(BaseCommand):
+    """
+    Watch a folder and import each file dropped in it, with the import
+    options given, in a pool of worker processes that stay running with
+    their database connections, so each file does not pay for starting
+    Django. Imported files are moved to the done or failed folder.
+    """
+
+    option_list = tuple([option for option in ImportCommand.option_list
+                         if option.dest not in ('workers', 'resume',
+                                                'error_file')]) + (
+               make_option('--workers', default=1, type='int',
+                           help='Import up to this many files at once, each in a worker process'),
+               make_option('--sleep', default=5, type='float',
+                           help='Seconds to wait between checks of the folder'),
+               make_option('--settle', default=2, type='float',
+                           help='Seconds a file must be unchanged before it is imported'),
+               make_option('--once', action='store_true', default=False,
+                           help='Exit when the folder is empty rather than wait for files')
+                   )
+    args = '<folder>'
+    help = "Imports the files dropped in a folder"
+
+    def handle(self, *args, **options):
+        from ...parallel import close_connection
+        from ...watch import DropFolder, import_claimed
+        if len(args) != 1 or not os.path.isdir(args[0]):
+            raise CommandError('Give the folder to watch')
+        folder = DropFolder(args[0])
+        # Each file is imported by one process, without a checkpoint to resume
+        task_options = ImportCommand().import_options(options)
+        task_options.update({'workers': 1, 'resume': None})
+        workers = max(int(options.get('workers') or 1), 1)
+        once = options.get('once')
+        settle = options.get('settle', 2)
+        sleep = options.get('sleep', 5)
+
+        pool = None
+        if workers > 1:
+            close_connection()
+            pool = multiprocessing.Pool(workers, initializer=close_connection)
+        running = []
+        try:
+            while True:
+                for path, result in running[:]:
+                    if result.ready():
+                        running.remove((path, result))
+                        self.finish(folder, path, result)
+                pending = folder.pending(0 if once else settle)
+                claimed = 0
+                for name in pending[:workers - len(running)]:
+                    path = folder.claim(name)
+                    if path is None:
+                        continue
+                    claimed += 1
+                    task = (task_options, path,
+                            os.path.join(folder.path, name))
+                    if pool:
+                        running.append((path, pool.apply_async(import_claimed,
+                                                               [task])))
+                    else:
+                        self.finish(folder, path, import_claimed(task))
+                if claimed and len(running) < workers:
+                    # Look for more files while there are free workers
+                    continue
+                if running:
+                    # Wake as soon as the oldest import is done
+                    running[0][1].wait(sleep)
+                elif once:
+                    return
+                else:
+                    time.sleep(sleep)
+        finally:
+            if pool:
+                # Let the running imports finish
+                pool.close()
+                pool.join()
+                for path, result in running:
+                    self.finish(folder, path, result)
+
+    def finish(self, folder, path, result):
+        """ Move an imported file on and report its result """
+        if not isinstance(result, dict):
+            # The AsyncResult of an import in the pool
+            try:
+                result = result.get()
+            except Exception, err:
+                result = {'failed': True, 'rows': 0, 'csvimport_ids': [],
+                          'error': str(err)}
+        target = folder.finish(path, result['failed'])
+        message = 'Imported %s: %s, %s rows' % (
+            target, result['failed'] and 'failed' or 'done', result['rows'])
+        if result['csvimport_ids']:
+            message += ', CSVImport %s' % ', '.join(
+                [str(pk) for pk in result['csvimport_ids']])
+        if result['error']:
+            message += ', %s' % result['error']
+        print message
@@ -0,0 +1,34 @@
+# Import the queued admin uploads
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, BaseCommand
+
+
+class Command(NoArgsCommand):
+    """
+    Import the admin uploads queued by the DatabaseQueue executor,
+    oldest first, polling for new uploads until stopped.
+    """
+
+    option_list = BaseCommand.option_list + (
+               make_option('--once', action='store_true', default=False,
+                           help='Exit when the queue is empty rather than wait for uploads'),
+               make_option('--sleep', default=5, type='float',
+                           help='Seconds to wait between checks of an empty queue')
+                   )
+    help = "Imports the csv files queued from the admin"
+
+    def handle_noargs(self, **options):
+        from ...executor import DatabaseQueue, run_import
+        queue = DatabaseQueue()
+        while True:
+            csvimp = queue.claim()
+            if csvimp is None:
+                if options.get('once'):
+                    return
+                time.sleep(options.get('sleep', 5))
+                continue
+            csvimp = run_import(csvimp)
+            print 'Imported %s: %s, %s rows' % (csvimp.id, csvimp.status,
+                                                 csvimp.rows_processed)
@@ -0,0 +1,114 @@
+""" Process wide cache of the model metadata and parsed mappings of imports
+
+    Worker processes and csvimport_watch import many files for the same few
+    models, so the field map of each model, the related models found by name
+    and each parsed mapping string are kept for the life of the process
+    rather than rebuilt for every import. The caches are cleared whenever a
+    model class is prepared, so models defined later are seen.
+"""
+import re
+
+from django.db import models
+from django.db.models.signals import class_prepared
+
+# Maximum number of entries in each cache before it is emptied
+CACHE_SIZE = 1000
+MAPPING = re.compile(r'(\*?\w+)=(\w+)(\(\w+\|\w+\))?')
+FOREIGNKEY = re.compile(r'(\w+)\|(\w+)', re.U)
+
+FIELDMAPS = {}
+RELATED_MODELS = {}
+MAPPINGS = {}
+
+
+def clear(**kwargs):
+    """ Empty the caches """
+    for cache in (FIELDMAPS, RELATED_MODELS, MAPPINGS):
+        cache.clear()
+
+class_prepared.connect(clear, dispatch_uid='csvimport.metadata.clear')
+
+
+def cached(cache, key, build):
+    """ The cached value for the key, built and added if it is missing """
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    if len(cache) >= CACHE_SIZE:
+        cache.clear()
+    value = cache[key] = build()
+    return value
+
+
+def field_map(model):
+    """ The fields of a model by name, with foreign keys also by their
+        name_id. It is shared so must not be changed.
+    """
+    def build():
+        fieldmap = {}
+        for field in model._meta.fields:
+            fieldmap[field.name] = field
+            if field.__class__ == models.ForeignKey:
+                fieldmap[field.name + "_id"] = field
+        return fieldmap
+    return cached(FIELDMAPS, (model._meta.app_label, model._meta.object_name),
+                  build)
+
+
+def related_model(name, app_label):
+    """ The model with a name in any app, or in the app given if there
+        is not exactly one
+    """
+    def build():
+        found = [model for model in models.get_models()
+                 if model.__name__.lower() == name.lower()]
+        if len(found) == 1:
+            return found[0]
+        return models.get_model(app_label, name)
+    return cached(RELATED_MODELS, (name.lower(), app_label), build)
+
+
+def parse_foreignkey(key):
+    """
+    Parse the foreignkey syntax (Key|field)
+
+    >>> parse_foreignkey('(a|b)')
+    ('a', 'b')
+    """
+    if key.startswith('(') and key.endswith(')'):
+        key = key[1:-1]
+    found = FOREIGNKEY.search(key)
+    if found != None:
+        return (found.group(1), found.group(2))
+    return None
+
+
+def parse_mappings(mappings):
+    """
+    Parse the custom mapping syntax (column1=field1(ForeignKey|field),
+    etc.), returning a tuple of the mappings, and of the fields and the
+    related fields to use for deduplication
+
+    >>> parse_mappings('column1=b(c|d)')
+    ((('1', 'b', ('c', 'd')),), (), ())
+
+    * indicates that this field should be used for deduplication
+    """
+    def build():
+        parsed = []
+        unique_fields = []
+        unique_related_fields = []
+        args = mappings.replace(',', ' ').replace('column', '')
+        for column, field, foreignkey in MAPPING.findall(args):
+            foreignkey = parse_foreignkey(foreignkey)
+            if column.startswith('*'):
+                column = column[1:]
+                if foreignkey:
+                    unique_related_fields.append(foreignkey[1])
+                else:
+                    unique_fields.append(field)
+            parsed.append((column, field, foreignkey))
+        return (tuple(parsed), tuple(unique_fields),
+                tuple(unique_related_fields))
+    return cached(MAPPINGS, mappings, build)
@@ -6,6 +6,8 @@ import re
 
 fs = FileSystemStorage(location=settings.MEDIA_ROOT)
 CHOICES = (('manual', 'manual'), ('cronjob', 'cronjob'))
+STATUSES = (('queued', 'queued'), ('running', 'running'),
+            ('done', 'done'), ('failed', 'failed'))
 
 # Create your models here.
 if not settings.CSVIMPORT_MODELS:
@@ -37,6 +39,21 @@ class CSVImport(models.Model):
     import_date = models.DateField(auto_now=True)
     import_user = models.CharField(max_length=255, default='anonymous',
                                    help_text='User id as text', blank=True)
+    checkpoint_row = models.PositiveIntegerField(default=0,
+                        help_text='Number of rows imported at the last checkpoint')
+    checkpoint_offset = models.BigIntegerField(default=0,
+                        help_text='Byte offset in the file after the last checkpoint row')
+    fingerprint = models.CharField(max_length=40, blank=True,
+                        help_text='Fingerprint of the file to check it is unchanged on resume')
+    defaults = models.TextField(blank=True,
+                        help_text='Default values for the import of a queued upload')
+    sheet = models.CharField(max_length=255, blank=True,
+                        help_text='The worksheet of an xlsx file, by name or number, the first if blank')
+    status = models.CharField(max_length=10, default='done', choices=STATUSES)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_per_second = models.FloatField(default=0)
+    stats = models.TextField(blank=True,
+                        help_text='Counts and timings of the import as json')
 
     def error_log_html(self):
         return re.sub('\n', '<br/>', self.error_log)
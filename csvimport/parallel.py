@@ -0,0 +1,143 @@
+""" Import csv files with several processes
+
+    A single file is split into byte ranges that start and end on record
+    boundaries, quoted newlines included, and each range is imported by
+    a worker process with its own database connection.
+    The files of a directory are each imported by a worker process.
+
+    Workers cannot see each other's uncommitted rows, so parallel imports
+    are only run with deduplication off, when every row is a new row.
+"""
+import itertools
+import os
+import re
+
+from csvimport.reader import CHUNK_SIZE, ByteLines, RowDecoder, decode_rows
+
+NEWLINE = re.compile(r'[\r\n]')
+
+
+def record_boundaries(path, parts, start=0):
+    """ Split a file from the start offset, which must be the beginning
+        of a record, into at most parts byte ranges, each starting at
+        the beginning of a record.
+        Returns a list of (start, end) offsets.
+    """
+    size = os.path.getsize(path)
+    boundaries = [start]
+    handle = open(path, 'rb')
+    try:
+        for part in range(1, parts):
+            target = start + (size - start) * part // parts
+            if target <= boundaries[-1]:
+                continue
+            # Only the parity of the quote count up to the target matters
+            handle.seek(boundaries[-1])
+            quotes = 0
+            position = boundaries[-1]
+            while position < target:
+                chunk = handle.read(min(CHUNK_SIZE, target - position))
+                if not chunk:
+                    break
+                quotes += chunk.count('"')
+                position += len(chunk)
+            boundary = find_newline(handle, position, quotes % 2)
+            if boundary is None or boundary >= size:
+                break
+            boundaries.append(boundary)
+    finally:
+        handle.close()
+    boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def find_newline(handle, position, quoted):
+    """ The offset after the first newline outside quotes from position """
+    handle.seek(position)
+    chunk = handle.read(CHUNK_SIZE)
+    while chunk:
+        start = 0
+        for match in NEWLINE.finditer(chunk):
+            quoted = (quoted + chunk.count('"', start, match.start())) % 2
+            start = match.start()
+            if not quoted:
+                end = match.end()
+                if chunk[match.start()] == '\r':
+                    # Keep \r\n together, reading on if it spans chunks
+                    if end == len(chunk):
+                        if handle.read(1) == '\n':
+                            end += 1
+                    elif chunk[end] == '\n':
+                        end += 1
+                return position + end
+        quoted = (quoted + chunk.count('"', start)) % 2
+        position += len(chunk)
+        chunk = handle.read(CHUNK_SIZE)
+    return None
+
+
+def range_rows(path, start, end, charset):
+    """ Yield the decoded csv rows between two byte offsets """
+    return decode_rows(ByteLines(path, start, end), charset)
+
+
+def close_connection():
+    """ Each worker process must open its own database connection """
+    from django.db import connection
+    connection.close()
+
+
+def import_range(task):
+    """ Import one byte range of a file in a worker process """
+    from csvimport.management.commands.csvimport import Command
+    options, path, start, end, header, logid = task
+    decoder = RowDecoder(options['charset'])
+    rows = decoder.rows(ByteLines(path, start, end))
+    if start:
+        # Only the first range includes the header row
+        rows = itertools.chain([header], rows)
+    cmd = Command()
+    # Ranges finish out of order so cannot checkpoint the import
+    cmd.checkpoint = False
+    cmd.setup(rows=rows, **options)
+    cmd.run(logid=logid)
+    return {'loglist': cmd.loglist,
+            'importlist': cmd.importlist,
+            'rows': cmd.rowcount,
+            'decode_errors': decoder.errors,
+            'stats': cmd.stats.as_dict()}
+
+
+
+def import_file(task):
+    """ Import one file of a directory, with its own header and mappings,
+        and save its CSVImport log
+        The task may end with the name to record for a file that was
+        moved to be imported
+    """
+    from csvimport.management.commands.csvimport import Command, \
+         save_csvimport
+    options, path, member = task[:3]
+    file_name = task[3:] and task[3] or path
+    if member:
+        file_name = '%s:%s' % (file_name, member)
+    cmd = Command()
+    cmd.file_name = file_name
+    csvimport_id = save_csvimport(cmd.import_props('', 'running'))
+    failed = False
+    try:
+        cmd.setup(csvfile=path, member=member, **options)
+        cmd.file_name = file_name
+        cmd.run(logid=csvimport_id)
+    except Exception, err:
+        failed = True
+        cmd.loglist.append('Import failed: %s' % err)
+    props = cmd.import_props('\n'.join(cmd.loglist),
+                             failed and 'failed' or 'done')
+    return {'file_name': cmd.file_name,
+            'failed': failed,
+            'loglist': cmd.loglist,
+            'importlist': cmd.importlist,
+            'rows': cmd.rowcount,
+            'stats': cmd.stats.as_dict(),
+            'csvimport_id': save_csvimport(props, csvimport_id=csvimport_id)}
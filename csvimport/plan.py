@@ -0,0 +1,210 @@
+""" Compiled plan of how each csv column is converted and stored
+
+    The plan resolves the column index, target field and converters of
+    every mapping once per import, so the row loop only applies them.
+    Converters are called with the value, field name and ErrorLog.
+    The format of each date column is inferred from a sample of rows.
+    Rows of typed cells, from a spreadsheet, keep their numbers and dates.
+"""
+from collections import OrderedDict
+
+from csvimport.dates import DateConverter
+from csvimport.errors import NOT_A_NUMBER, TOO_BIG, TOO_SMALL, \
+     NOT_AN_INTEGER, NEGATIVE, DEBUG
+
+INTEGER = ['BigIntegerField', 'IntegerField', 'AutoField',
+           'PositiveIntegerField', 'PositiveSmallIntegerField']
+FLOAT = ['DecimalField', 'FloatField']
+NUMERIC = INTEGER + FLOAT
+BOOLEAN = ['BooleanField', 'NullBooleanField']
+BOOLEAN_TRUE = [1, '1', 'Y', 'Yes', 'yes', 'True', 'true', 'T', 't']
+DATEFIELD = ['DateField', 'DateTimeField']
+MAXINT = 9223372036854775807
+NOT_INTEGERS = ('nan', 'inf', '+inf', '-inf')
+NUMBERS = (int, long, float)
+
+
+def strip(value, field, errors):
+    """ Strip out unecessary spaces if needed """
+    try:
+        return value.strip()
+    except AttributeError:
+        return value
+
+
+def to_text(value, field, errors):
+    """ A typed cell as the text it would be in a csv file """
+    if isinstance(value, basestring):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return unicode(value)
+
+
+def to_boolean(value, field, errors):
+    """ Tidy up boolean data """
+    return value in BOOLEAN_TRUE
+
+
+def to_number(value, field, errors):
+    """ Tidy up numeric data """
+    if not value:
+        return 0
+    if isinstance(value, NUMBERS):
+        return value
+    try:
+        return float(value)
+    except:
+        errors.add(field, NOT_A_NUMBER,
+                   'Column %s = %s is not a number so is set to 0'
+                   % (field, value))
+        return 0
+
+
+def to_integer(value, field, errors):
+    """ Tidy up integer data, after it is converted to a number """
+    if isinstance(value, (int, long)) and -MAXINT <= value <= MAXINT:
+        return value
+    if value > MAXINT:
+        errors.add(field, TOO_BIG,
+                   'Column %s = %s more than the max integer 9223372036854775807'
+                   % (field, value))
+        return 0
+    if value < -MAXINT:
+        errors.add(field, TOO_SMALL,
+                   'Column %s = %s less than the min integer -9223372036854775807 so is set to 0'
+                   % (field, value))
+        return 0
+    if str(value).lower() in NOT_INTEGERS:
+        errors.add(field, NOT_AN_INTEGER,
+                   'Column %s = %s is not an integer so is set to 0'
+                   % (field, value))
+        return 0
+    return int(value)
+
+
+def to_positive(value, field, errors):
+    """ Tidy up positive integer data, after it is converted to an integer """
+    if value < 0:
+        errors.add(field, NEGATIVE,
+                   'Column %s = %s, less than zero so set to 0'
+                   % (field, value))
+        return 0
+    return value
+
+
+def converters_for(field_type):
+    """ The converters for a model field internal type """
+    if field_type in BOOLEAN:
+        return (to_boolean,)
+    if field_type in NUMERIC:
+        converters = (to_number,)
+        if field_type in INTEGER:
+            converters += (to_integer,)
+            if field_type.startswith('Positive'):
+                converters += (to_positive,)
+        return converters
+    if field_type in DATEFIELD:
+        return (DateConverter(field_type == 'DateTimeField'),)
+    return ()
+
+
+class ImportPlan(object):
+    """ The columns of an import, each a tuple of its row index,
+        model field name, related field name (or None) and converters,
+        and the default values, which replace those of the columns
+    """
+
+    def __init__(self, mappings, fieldmap, header=None, nameindexes=False,
+                 debug=False, model_name='', defaults=(), typed=False):
+        # The related model name of each foreign key field
+        self.related = OrderedDict()
+        self.date_columns = []
+        columns = []
+        for (column, field, foreignkey) in mappings:
+            # either proceed in order or use the indexes to find
+            # the right column
+            if nameindexes:
+                index = header.index(column)
+            else:
+                index = int(column) - 1
+
+            converters = (strip,)
+            if debug:
+                converters += (self.debug_logger(model_name),)
+            field_converters = converters_for(fieldmap[field].get_internal_type())
+            if typed and not field_converters:
+                field_converters = (to_text,)
+            converters += field_converters
+            for convert in converters:
+                if isinstance(convert, DateConverter):
+                    self.date_columns.append((index, convert))
+
+            columns.append((index, field, self.related_field(field, foreignkey),
+                            converters))
+        self.columns = tuple(columns)
+        self.defaults = tuple([
+            (field, self.related_field(field, foreignkey),
+             converters_for(fieldmap[field].get_internal_type()), value)
+            for (field, value, foreignkey) in defaults])
+
+    def related_field(self, field, foreignkey):
+        """ The related field name of a foreign key mapping, or None """
+        if not foreignkey:
+            return None
+        self.related.setdefault(field, foreignkey[0])
+        return foreignkey[1]
+
+    def related_fields(self, field):
+        """ The related model fields mapped for a foreign key """
+        names = [related_field for (index, name, related_field, converters)
+                 in self.columns if name == field and related_field]
+        names.extend([related_field for (name, related_field, converters,
+                                         value) in self.defaults
+                      if name == field and related_field
+                      and related_field not in names])
+        return names
+
+    def infer(self, rows):
+        """ Infer the format of each date column from a sample of rows """
+        for index, convert in self.date_columns:
+            convert.infer([row[index].strip() for row in rows
+                           if len(row) > index
+                           and isinstance(row[index], basestring)
+                           and row[index].strip()])
+
+    def debug_logger(self, model_name):
+        """ Converter that logs each mapped value """
+        def log_value(value, field, errors):
+            errors.add(field, DEBUG,
+                       '%s.%s = "%s"' % (model_name, field, value))
+            return value
+        return log_value
+
+    def apply(self, row, errors):
+        """ Convert the mapped cells of a row in place
+            Returns the main model field values and, for each foreign key,
+            its related model field values
+        """
+        main_model_fields = {}
+        related = {}
+        for index, field, related_field, converters in self.columns:
+            value = row[index]
+            for convert in converters:
+                value = convert(value, field, errors)
+            row[index] = value
+
+            # Store the value in the appropriate field dictionary
+            if value != '':
+                if related_field:
+                    related.setdefault(field, {})[related_field] = value
+                else:
+                    main_model_fields[field] = value
+        for field, related_field, converters, value in self.defaults:
+            for convert in converters:
+                value = convert(value, field, errors)
+            if related_field:
+                related.setdefault(field, {})[related_field] = value
+            else:
+                main_model_fields[field] = value
+        return main_model_fields, related
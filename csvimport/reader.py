@@ -0,0 +1,349 @@
+""" Reading csv rows from the raw bytes of a file
+
+    The csv module parses bytes, so for ASCII compatible charsets, which
+    most files are, the raw lines are parsed and each row is decoded once.
+    Other charsets are recoded to UTF-8 as they are read.
+    Compressed files are recognised by their magic bytes and decompressed
+    as they are read, rather than to a file first.
+"""
+import bz2
+import codecs
+import csv
+import gzip
+import hashlib
+import itertools
+import os
+import zipfile
+
+from chardet.universaldetector import UniversalDetector
+
+from csvimport.xlsx import is_xlsx, XLSXReader
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+CHUNK_SIZE = 64 * 1024
+# Default maximum number of bytes read from a file to detect its charset
+CHARSET_SAMPLE = 1024 * 1024
+BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF32_LE, 'utf-32'),
+        (codecs.BOM_UTF32_BE, 'utf-32'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'))
+MAGIC = (('\x1f\x8b', 'gzip'),
+         ('BZh', 'bz2'),
+         ('\xfd7zXZ\x00', 'xz'),
+         ('PK\x03\x04', 'zip'))
+# Suffixes of the files imported from a directory
+SUFFIXES = ('.csv', '.xlsx', '.gz', '.bz2', '.xz', '.zip')
+
+
+def ascii_compatible(charset):
+    """ Can the raw bytes be split on newlines and quotes for this charset """
+    try:
+        return all([char.encode(charset) == char for char in '\r\n"'])
+    except (LookupError, UnicodeError):
+        return False
+
+
+def compression(path):
+    """ The compression of a file from its magic bytes, or None """
+    handle = open(path, 'rb')
+    try:
+        start = handle.read(6)
+    finally:
+        handle.close()
+    for magic, name in MAGIC:
+        if start.startswith(magic):
+            return name
+    return None
+
+
+def csv_members(path):
+    """ The names of the csv files in a zip file, in order """
+    archive = zipfile.ZipFile(path)
+    try:
+        return [name for name in archive.namelist()
+                if name.lower().endswith('.csv')
+                and not name.startswith('__MACOSX/')]
+    finally:
+        archive.close()
+
+
+def csv_sources(path):
+    """ The path and zip member, or None, of each csv or xlsx file to
+        import from a directory, a zip file or a single file
+    """
+    if os.path.isdir(path):
+        sources = []
+        for name in sorted(os.listdir(path)):
+            filepath = os.path.join(path, name)
+            if name.endswith(SUFFIXES) and os.path.isfile(filepath):
+                sources.extend(csv_sources(filepath))
+        return sources
+    if compression(path) == 'zip' and not is_xlsx(path):
+        return [(path, member) for member in csv_members(path)]
+    return [(path, None)]
+
+
+def open_stream(path, member=None):
+    """ Open a file for reading its bytes, decompressing them if it is
+        compressed. A zip file's csv member is read, the first if not given
+    """
+    kind = compression(path)
+    if kind == 'gzip':
+        return gzip.GzipFile(path, 'rb')
+    if kind == 'bz2':
+        return bz2.BZ2File(path, 'rb')
+    if kind == 'xz':
+        if lzma is None:
+            raise Exception('Reading %s needs the lzma module, pip install '
+                            'backports.lzma' % path)
+        return lzma.LZMAFile(path, 'rb')
+    if kind == 'zip':
+        archive = zipfile.ZipFile(path)
+        try:
+            if member is None:
+                members = csv_members(path)
+                if not members:
+                    raise Exception('No csv files found in %s' % path)
+                member = members[0]
+            # The member has its own handle on the file
+            return archive.open(member)
+        finally:
+            archive.close()
+    return open(path, 'rb')
+
+
+def detect_charset(filehandle, sample=CHARSET_SAMPLE):
+    """ Detect the charset from at most sample bytes of the file
+        Returns the charset and the number of bytes examined
+    """
+    chunk = filehandle.read(min(CHUNK_SIZE, sample))
+    for bom, charset in BOMS:
+        if chunk.startswith(bom):
+            return charset, len(bom)
+
+    # Most files are ASCII or UTF-8 so check that first, keeping the chunks
+    # for chardet since a decompressed stream cannot seek back to the start
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = []
+    examined = 0
+    try:
+        while chunk:
+            chunks.append(chunk)
+            decoder.decode(chunk)
+            examined += len(chunk)
+            if examined >= sample:
+                break
+            chunk = filehandle.read(min(CHUNK_SIZE, sample - examined))
+        return 'utf-8', examined
+    except UnicodeDecodeError:
+        pass
+
+    # Otherwise feed chardet until it is confident or the sample is used up
+    detector = UniversalDetector()
+    examined = 0
+    chunk = chunks.pop(0)
+    while chunk:
+        detector.feed(chunk)
+        examined += len(chunk)
+        if detector.done or examined >= sample:
+            break
+        if chunks:
+            chunk = chunks.pop(0)
+        else:
+            chunk = filehandle.read(min(CHUNK_SIZE, sample - examined))
+    detector.close()
+    return detector.result['encoding'] or 'utf-8', examined
+
+
+def file_fingerprint(path):
+    """ Fingerprint of a file from its size and its first and last chunks,
+        to tell if it has changed without reading all of it
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size))
+    handle = open(path, 'rb')
+    try:
+        digest.update(handle.read(CHUNK_SIZE))
+        if size > CHUNK_SIZE:
+            handle.seek(max(size - CHUNK_SIZE, CHUNK_SIZE))
+            digest.update(handle.read(CHUNK_SIZE))
+    finally:
+        handle.close()
+    return digest.hexdigest()
+
+
+class ByteLines(object):
+    """ The lines of a file between two byte offsets, split on \\r, \\n
+        or \\r\\n. The offset is the end of the last line returned, which
+        after a csv row is read is the end of that row.
+    """
+
+    def __init__(self, path, start=0, end=None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.offset = start
+
+    def __iter__(self):
+        handle = open(self.path, 'rb')
+        try:
+            handle.seek(self.start)
+            self.offset = self.start
+            if self.end is None:
+                remaining = os.path.getsize(self.path) - self.start
+            else:
+                remaining = self.end - self.start
+            pending = ''
+            while remaining > 0:
+                chunk = handle.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                lines = (pending + chunk).splitlines(True)
+                # The last line may be incomplete, or a \r before a \n
+                pending = lines.pop()
+                for line in lines:
+                    self.offset += len(line)
+                    yield line
+            if pending:
+                self.offset += len(pending)
+                yield pending
+        finally:
+            handle.close()
+
+
+def stream_lines(handle, charset=None):
+    """ The lines of an open file read in chunks, which are recoded to
+        UTF-8 from a charset that is not ASCII compatible, such as UTF-16,
+        if one is given. The file is closed at the end.
+    """
+    decoder = charset and codecs.getincrementaldecoder(charset)()
+    try:
+        pending = ''
+        while True:
+            chunk = handle.read(CHUNK_SIZE)
+            text = chunk
+            if decoder:
+                text = decoder.decode(chunk, not chunk).encode('utf-8')
+            lines = (pending + text).splitlines(True)
+            pending = lines.pop() if lines else ''
+            for line in lines:
+                yield line
+            if not chunk:
+                break
+        if pending:
+            yield pending
+    finally:
+        handle.close()
+
+
+class RowDecoder(object):
+    """ Parse csv rows from lines of bytes in an ASCII compatible charset
+        and decode each row in one call rather than cell by cell.
+        Bytes that are not valid in the charset are replaced, and the
+        number of rows with them is counted in errors.
+    """
+
+    def __init__(self, charset):
+        self.charset = charset
+        self.errors = 0
+
+    def rows(self, lines):
+        decode = codecs.getdecoder(self.charset)
+        for row in csv.reader(lines):
+            if not row:
+                yield row
+                continue
+            # A NUL byte is a NUL character in any ASCII compatible charset
+            joined = '\x00'.join(row)
+            try:
+                text = decode(joined)[0]
+            except UnicodeDecodeError:
+                self.errors += 1
+                text = decode(joined, 'replace')[0]
+            yield text.split(u'\x00')
+
+
+def decode_rows(lines, charset):
+    """ Parse csv rows from lines of bytes and decode them """
+    return RowDecoder(charset).rows(lines)
+
+
+class CSVReader(object):
+    """ The rows of a csv file, or a zip file's csv member, decoded to
+        unicode, with the charset detected from a sample of the file unless
+        it is given. Compressed files are decompressed as they are read.
+        For uncompressed ASCII compatible files offset is the byte offset
+        of the end of the last row read, and reading can start from one,
+        in which case the header row is read first. Otherwise offset is None.
+    """
+
+    def __init__(self, path, charset='', start=0, sample=CHARSET_SAMPLE,
+                 member=None):
+        self.path = path
+        self.member = member
+        self.compression = compression(path)
+        self.examined = None
+        if not charset:
+            handle = open_stream(path, member)
+            try:
+                charset, self.examined = detect_charset(handle, sample)
+            finally:
+                handle.close()
+        self.charset = charset
+        self.lines = None
+        if ascii_compatible(charset):
+            if not self.compression:
+                self.lines = ByteLines(path, start)
+            self.decoder = RowDecoder(charset)
+        else:
+            self.decoder = RowDecoder('utf-8')
+
+    @property
+    def offset(self):
+        if self.lines is None:
+            return None
+        return self.lines.offset
+
+    @property
+    def decode_errors(self):
+        """ The number of rows read with bytes invalid in the charset """
+        return self.decoder.errors
+
+    def label(self):
+        """ The charset used and how many bytes were read to detect it """
+        if self.examined is None:
+            return self.charset
+        return ('%s (%s bytes)' % (self.charset, self.examined))[:32]
+
+    def __iter__(self):
+        if self.lines is None:
+            recode = None
+            if not ascii_compatible(self.charset):
+                recode = self.charset
+            return self.decoder.rows(stream_lines(
+                open_stream(self.path, self.member), recode))
+        if not self.lines.start:
+            return self.decoder.rows(self.lines)
+        rows = self.decoder.rows(ByteLines(self.path))
+        header = list(itertools.islice(rows, 1))
+        rows.close()
+        return itertools.chain(header, self.decoder.rows(self.lines))
+
+
+def open_reader(path, charset='', start=0, sample=CHARSET_SAMPLE,
+                member=None, sheet=''):
+    """ The reader of the rows of a file, an XLSXReader for an Excel
+        workbook and otherwise a CSVReader
+    """
+    if member is None and compression(path) == 'zip' and is_xlsx(path):
+        return XLSXReader(path, sheet)
+    return CSVReader(path, charset, start, sample, member)
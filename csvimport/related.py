@@ -0,0 +1,171 @@
+""" Resolving the related model instances of the foreign key columns
+    of a batch of rows
+
+    The instances not in the cache are looked up with one query per batch,
+    and the missing ones are inserted together, so the queries per row do
+    not grow with the number of foreign key columns. Without deduplication
+    the new instance of every row is inserted together with the rest of
+    the batch, on databases where the loader can tell their keys.
+    Only the rows of a batch that fails to insert are saved one by one.
+"""
+from collections import OrderedDict
+
+from django.db import connections, router
+
+from csvimport.cache import RelatedCache
+from csvimport.commits import write_bisecting
+from csvimport.loaders import ReturningLoader
+
+
+class RelatedResolver(object):
+    """ Find, update or create the related instances of one foreign key
+        for a batch of rows, matching them on the match fields
+        Without deduplication a new instance is inserted for every row.
+    """
+
+    def __init__(self, model, match_fields, cache_size=10000,
+                 deduplicate=True, using=None):
+        self.model = model
+        self.deduplicate = deduplicate
+        self.using = using
+        self.cache = RelatedCache(model, match_fields, cache_size)
+        self.loader = None
+        if ReturningLoader.supported(connections[using or
+                                                 router.db_for_write(model)]):
+            self.loader = ReturningLoader(model)
+
+    def resolve(self, values_list, csvimportid, failed):
+        """ The related instance for each dictionary of related field
+            values, or None where there are no values or it failed to save
+            failed is called with the instance and error of failed saves
+        """
+        instances = [None] * len(values_list)
+        if not self.deduplicate:
+            for index, values in enumerate(values_list):
+                if values:
+                    instances[index] = self.model(**values)
+            new = [instance for instance in instances if instance]
+            if self.loader:
+                self.create([(None, instance) for instance in new],
+                            csvimportid, failed)
+            else:
+                # Without the keys of bulk inserts each is saved
+                self.save(new, csvimportid, failed)
+            return self.saved(instances)
+
+        # Rows are grouped by key so each related instance is written once
+        pending = OrderedDict()
+        keyless = []
+        for index, values in enumerate(values_list):
+            if not values:
+                continue
+            key = self.cache.key(values)
+            cached = self.cache.get(key) if key else None
+            if cached:
+                instances[index] = self.cached(key, cached, values,
+                                               csvimportid, failed)
+            elif key:
+                pending.setdefault(key, []).append(index)
+            else:
+                # Rows without match values are not the same instance
+                instances[index] = self.model(**values)
+                keyless.append(instances[index])
+        self.save(keyless, csvimportid, failed)
+        if not pending:
+            return self.saved(instances)
+
+        existing = self.cache.index.existing(pending.keys())
+        updates = []
+        creates = []
+        resolved = []
+        for key, indexes in pending.items():
+            values = {}
+            for index in indexes:
+                values.update(values_list[index])
+            instance = existing.get(key)
+            if instance is None:
+                instance = self.model(**values)
+                creates.append((key, instance))
+            elif self.cache.index.update(instance, values):
+                updates.append(instance)
+            resolved.append((key, instance, values))
+            for index in indexes:
+                instances[index] = instance
+        self.save(updates, csvimportid, failed)
+        self.create(creates, csvimportid, failed)
+        for key, instance, values in resolved:
+            if instance.pk is not None:
+                self.cache.put(key, instance.pk, values)
+        return self.saved(instances)
+
+    def cached(self, key, cached, values, csvimportid, failed):
+        """ An instance from the cache, saved only if its values changed """
+        pk, old = cached
+        incoming = self.cache.normalise(values)
+        changed = [name for name, value in incoming.items()
+                   if old.get(name) != value]
+        values = dict(old, **incoming)
+        instance = self.cache.instance(pk, values)
+        instance.csvimport_id = csvimportid
+        if changed:
+            self.save([instance], csvimportid, failed, changed)
+            self.cache.put(key, pk, values)
+        return instance
+
+    def save(self, instances, csvimportid, failed, update_fields=None):
+        """ Save each instance in a savepoint """
+        for instance in instances:
+            instance.csvimport_id = csvimportid
+            write_bisecting([instance],
+                            lambda part: self.save_one(part[0], update_fields),
+                            failed, self.using)
+
+    def save_one(self, instance, update_fields=None):
+        # New instances skip the update tried first for natural keys
+        if instance._state.adding:
+            instance.save(force_insert=True)
+        else:
+            instance.save(update_fields=update_fields)
+
+    def create(self, creates, csvimportid, failed):
+        """ Insert the new instances, a list of their keys and instances,
+            together then find their pks with one query unless the
+            database set them
+        """
+        instances = [instance for key, instance in creates]
+        if len(instances) < 2:
+            return self.save(instances, csvimportid, failed)
+        for instance in instances:
+            instance.csvimport_id = csvimportid
+
+        failures = set()
+
+        def failed_insert(instance, err):
+            failures.add(id(instance))
+            failed(instance, err)
+
+        write_bisecting(instances, self.insert, failed_insert, self.using)
+        missing = [(key, instance) for key, instance in creates
+                   if instance.pk is None and id(instance) not in failures]
+        if missing:
+            found = self.cache.index.existing([key for key, instance
+                                               in missing])
+            for key, instance in missing:
+                if key in found:
+                    instance.pk = found[key].pk
+        for instance in instances:
+            if id(instance) not in failures:
+                instance._state.adding = False
+
+    def insert(self, instances):
+        if len(instances) == 1:
+            self.save_one(instances[0])
+        elif self.loader:
+            self.loader.load(instances)
+        else:
+            self.model.objects.bulk_create(instances)
+
+    def saved(self, instances):
+        """ The instances, with None for those that were not saved """
+        return [instance if instance is not None and instance.pk is not None
+                else None for instance in instances]
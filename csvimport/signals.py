@@ -2,3 +2,7 @@ from django import dispatch
 
 imported_csv = dispatch.Signal(providing_args=['instance', 'created', 'row'])
 importing_csv = dispatch.Signal(providing_args=['instance', 'row'])
+# Sent for each batch with a list of (row, instance, created) tuples,
+# before the instances are saved and after
+importing_csv_batch = dispatch.Signal(providing_args=['rows'])
+imported_csv_batch = dispatch.Signal(providing_args=['rows'])
@@ -0,0 +1,172 @@
+""" Timings and counts of the stages of an import
+
+    Counts are always kept. Timing each stage, and counting the queries,
+    is only done when the stats are timed, otherwise the timers do nothing.
+"""
+import time
+
+from django.db import connection
+
+# Python 2 has no monotonic clock, so use the best wall clock
+clock = getattr(time, 'monotonic', time.time)
+
+STAGES = ('read', 'convert', 'signals', 'related', 'dedup', 'save')
+COUNTS = ('rows', 'created', 'updated', 'unchanged', 'upserted', 'skipped',
+          'errors', 'queries')
+
+
+class NullTimer(object):
+    """ Timer used when the stats are not timed """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer(object):
+    """ Add the time spent in a with block to a stage """
+
+    def __init__(self, seconds, stage):
+        self.seconds = seconds
+        self.stage = stage
+        self.start = 0
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds[self.stage] += clock() - self.start
+        return False
+
+
+class ImportStats(object):
+    """ The seconds spent in each stage of an import and its row counts """
+
+    def __init__(self, timed=False, progress_seconds=5):
+        self.timed = timed
+        self.progress_seconds = progress_seconds
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        for name in COUNTS:
+            setattr(self, name, 0)
+        self.started = None
+        self.finished = None
+        self.next_progress = 0
+        self.query_mark = 0
+        self.debug_cursor = None
+
+    def start(self):
+        """ Start the clock, and count queries if timed """
+        self.started = clock()
+        self.finished = None
+        self.next_progress = self.started + self.progress_seconds
+        if self.timed:
+            # Queries are only recorded by the debug cursor
+            self.debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            self.query_mark = len(connection.queries)
+
+    def stop(self):
+        """ Stop the clock and the query counting """
+        if self.started is None or self.finished is not None:
+            return
+        self.finished = clock()
+        if self.timed:
+            self.count_queries()
+            connection.use_debug_cursor = self.debug_cursor
+
+    def count_queries(self):
+        """ Add the queries run since the last count, dropping them from
+            the connection unless something else is recording them
+        """
+        if not self.timed or self.started is None:
+            return
+        mark = len(connection.queries)
+        self.queries += max(mark - self.query_mark, 0)
+        from django.conf import settings
+        if not self.debug_cursor and not settings.DEBUG:
+            del connection.queries[self.query_mark:]
+            mark = self.query_mark
+        self.query_mark = mark
+
+    def timer(self, stage):
+        """ Context manager timing a stage """
+        if self.timed:
+            return StageTimer(self.seconds, stage)
+        return NULL_TIMER
+
+    def timed_rows(self, rows):
+        """ The rows, with the time to read each one added to the
+            read stage if timed
+        """
+        if not self.timed:
+            return rows
+        return self.read_rows(iter(rows))
+
+    def read_rows(self, rows):
+        seconds = self.seconds
+        while True:
+            start = clock()
+            try:
+                row = next(rows)
+            except StopIteration:
+                seconds['read'] += clock() - start
+                return
+            seconds['read'] += clock() - start
+            yield row
+
+    def elapsed(self):
+        """ Seconds since the import started """
+        if self.started is None:
+            return 0
+        return (self.finished or clock()) - self.started
+
+    def rows_per_second(self):
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0
+        return self.rows / elapsed
+
+    def progress_due(self):
+        """ Whether progress_seconds have passed since it was last due """
+        now = clock()
+        if now < self.next_progress:
+            return False
+        self.next_progress = now + self.progress_seconds
+        return True
+
+    def merge(self, stats):
+        """ Add the counts and stage times of another import's as_dict """
+        for name in COUNTS:
+            setattr(self, name, getattr(self, name) + stats.get(name, 0))
+        for stage, seconds in stats.get('seconds', {}).items():
+            self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+
+    def as_dict(self):
+        """ The stats as a dictionary that can be saved as json """
+        stats = dict([(name, getattr(self, name)) for name in COUNTS])
+        stats['elapsed'] = round(self.elapsed(), 3)
+        stats['rows_per_second'] = round(self.rows_per_second(), 1)
+        if self.timed:
+            stats['seconds'] = dict([(stage, round(seconds, 3))
+                                     for stage, seconds
+                                     in self.seconds.items()])
+        return stats
+
+    def summary(self):
+        """ Log lines of the stats """
+        lines = ['%s rows in %.2f seconds, %.1f rows per second' % (
+                 self.rows, self.elapsed(), self.rows_per_second()),
+                 'Created %s, updated %s, unchanged %s, upserted %s, '
+                 'skipped %s, errors %s'
+                 % (self.created, self.updated, self.unchanged, self.upserted,
+                    self.skipped, self.errors)]
+        if self.timed:
+            lines.append('Seconds per stage: %s, %s queries' % (
+                ', '.join(['%s %.3f' % (stage, self.seconds[stage])
+                           for stage in STAGES]), self.queries))
+        return lines
@@ -1,3 +1,11 @@
 from csvimport.tests.parse_tests import CommandParseTest
 from csvimport.tests.log_tests import LogTest
 from csvimport.tests.optional_tests import CommandArgsTest
+from csvimport.tests.batch_tests import BatchTest
+from csvimport.tests.cache_tests import RelatedCacheTest
+from csvimport.tests.parallel_tests import ParallelTest, ParallelImportTest
+from csvimport.tests.resume_tests import ResumeTest
+from csvimport.tests.queue_tests import QueueTest
+from csvimport.tests.stats_tests import StatsTest
+from csvimport.tests.query_tests import QueryBudgetTest
+from csvimport.tests.dates_tests import DatesTest
@@ -0,0 +1,74 @@
+""" Test batched imports """
+from csvimport.management.commands.csvimport import Command
+from csvimport.signals import importing_csv_batch, imported_csv_batch
+from csvimport.tests.testcase import CommandTestCase, DummyFileObj
+from csvimport.tests.models import Country
+
+
+class BatchTest(CommandTestCase):
+    """ Run test of bulk inserts of new rows in batches """
+
+    def test_bulk_create(self, filename='countries.csv'):
+        """ Import the countries in batches without deduplication """
+        self.command(filename, defaults='', modelname='tests.Country',
+                     deduplicate=False, batch_size=100)
+        self.assertEqual(Country.objects.count(), 246)
+        country = Country.objects.get(code='AF')
+        self.assertEqual(country.name, 'AFGHANISTAN')
+        self.assertEqual(country.latitude, 33)
+        Country.objects.all().delete()
+
+    def test_bulk_deduplicate(self, filename='countries.csv'):
+        """ Existing rows are updated rather than inserted again
+            and each batch is matched with a single query, plus the
+            savepoint the import's transaction is within the test's
+        """
+        self.command(filename, defaults='', modelname='tests.Country',
+                     batch_size=100)
+        with self.assertNumQueries(5):
+            self.command(filename, defaults='', modelname='tests.Country',
+                         batch_size=100)
+        self.assertEqual(Country.objects.count(), 246)
+        Country.objects.all().delete()
+
+    def test_batch_signals(self, filename='countries.csv'):
+        """ Receivers get each batch of rows, instances and created flags
+            before and after they are saved
+        """
+        batches = []
+
+        def receiver(sender, rows, signal, **kwargs):
+            batches.append((signal, rows))
+        importing_csv_batch.connect(receiver, sender=Country)
+        imported_csv_batch.connect(receiver, sender=Country)
+        self.addCleanup(importing_csv_batch.disconnect, receiver, sender=Country)
+        self.addCleanup(imported_csv_batch.disconnect, receiver, sender=Country)
+        self.command(filename, defaults='', modelname='tests.Country',
+                     deduplicate=False, batch_size=100)
+        self.assertEqual([(signal, len(rows)) for signal, rows in batches],
+                         [(importing_csv_batch, 100), (imported_csv_batch, 100),
+                          (importing_csv_batch, 100), (imported_csv_batch, 100),
+                          (importing_csv_batch, 46), (imported_csv_batch, 46)])
+        row, instance, created = batches[1][1][0]
+        self.assertEqual(row['code'], 'AF')
+        self.assertEqual(instance, Country.objects.get(code='AF'))
+        self.assertTrue(created)
+        Country.objects.all().delete()
+
+    def test_bisect(self, filename='countries.csv'):
+        """ A batch that fails is split until the failing rows are found,
+            and the rest of the batch is still written
+        """
+        Country.objects.create(code='AF', name='Existing')
+        Country.objects.create(code='GB', name='Existing')
+        cmd = Command()
+        uploaded = DummyFileObj()
+        uploaded.set_path(filename)
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  uploaded=uploaded, deduplicate=False, batch_size=100)
+        cmd.run(logid='batchtest')
+        self.assertEqual(Country.objects.count(), 246)
+        self.assertEqual(Country.objects.get(code='GB').name, 'Existing')
+        self.assertEqual((cmd.stats.created, cmd.stats.errors), (244, 2))
+        self.assertEqual(len(cmd.error_log), 2)
+        Country.objects.all().delete()
@@ -0,0 +1,9 @@
+""" Benchmarks of the import pipeline
+
+    Run with the test settings, eg. to time imports of 10k and 100k rows
+
+    DJANGO_SETTINGS_MODULE=csvimport.tests.settings \
+    python -m csvimport.tests.benchmark --rows=10000,100000 --output=bench.json
+
+    See run.py for the options.
+"""
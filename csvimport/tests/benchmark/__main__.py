@@ -0,0 +1,5 @@
+import sys
+
+from csvimport.tests.benchmark.run import main
+
+main(sys.argv[1:])
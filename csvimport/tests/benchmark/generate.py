@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+""" Deterministic synthetic csv files shaped like the test models
+
+    Every value is derived from the row key, so the same arguments always
+    write the same file. Duplicate rows repeat the values of an earlier key.
+"""
+import codecs
+import csv
+import random
+from cStringIO import StringIO
+
+STATUSES = ('Stock', 'On Order', 'ETA 10-AUG-2011', '')
+# Countries have a primary key of at most 4 characters
+MAX_COUNTRIES = 36 ** 4
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# The country code column is not named after the country foreign key,
+# which a header row would map to the country name
+ITEM_HEADER = ['code_share', 'code_org', 'organisation', 'description',
+               'uom', 'quantity', 'status', 'country_code']
+ITEM_MAPPINGS = ('column1=code_share,column2=code_org,'
+                 'column3=organisation(Organisation|name),'
+                 'column4=description,column5=uom(UnitOfMeasure|name),'
+                 'column6=quantity,column7=status')
+COUNTRY_HEADER = ['code', 'name', 'latitude', 'longitude', 'alias']
+COUNTRY_MAPPINGS = ('column1=code,column2=name,column3=latitude,'
+                    'column4=longitude,column5=alias')
+
+
+def country_code(key):
+    """ A unique code of up to 4 characters for each key """
+    key = key % MAX_COUNTRIES
+    code = ''
+    while True:
+        key, digit = divmod(key, 36)
+        code = DIGITS[digit] + code
+        if not key:
+            return code
+
+
+def item_row(key, cardinality):
+    """ The cells of the item with this key, the related organisation,
+        unit and country chosen from cardinality of each
+    """
+    related = key % cardinality
+    return [u'item%07d' % key,
+            u'WA%05d' % (key % 100000),
+            u'Organisation %d' % related,
+            u'Bâche n° %d, 4×60m, à livrer' % key,
+            u'Unit %d' % (related % 50),
+            unicode((key * 37) % 5000),
+            STATUSES[key % len(STATUSES)],
+            country_code(related)]
+
+
+def country_row(key, cardinality):
+    """ The cells of the country with this key """
+    return [country_code(key),
+            u'PAYS %d ÅÉÎ' % key,
+            unicode((key % 180) - 90),
+            unicode((key % 360) - 180),
+            u'Pays %d' % key]
+
+
+SHAPES = {'item': (ITEM_HEADER, item_row),
+          'country': (COUNTRY_HEADER, country_row)}
+
+
+def row_keys(rows, duplicates, seed):
+    """ The key of each row, a duplicates fraction of them repeating
+        an earlier key
+    """
+    rng = random.Random(seed)
+    unique = 0
+    for i in xrange(rows):
+        if unique and rng.random() < duplicates:
+            yield rng.randrange(unique)
+        else:
+            yield unique
+            unique += 1
+
+
+def generate(path, shape='item', rows=10000, cardinality=100,
+             duplicates=0.0, charset='utf-8', header=True, seed=0):
+    """ Write a csv file of rows of the shape ('item' or 'country')
+        in the charset, with cardinality distinct related values
+    """
+    columns, make_row = SHAPES[shape]
+    # The csv module writes bytes, so write utf-8 and then transcode
+    encoder = codecs.getincrementalencoder(charset)()
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    handle = open(path, 'wb')
+    try:
+        if header:
+            writer.writerow(columns)
+        for count, key in enumerate(row_keys(rows, duplicates, seed)):
+            writer.writerow([cell.encode('utf-8')
+                             for cell in make_row(key, cardinality)])
+            if count % 1000 == 999:
+                handle.write(encoder.encode(buffer.getvalue().decode('utf-8')))
+                buffer.seek(0)
+                buffer.truncate()
+        handle.write(encoder.encode(buffer.getvalue().decode('utf-8'),
+                                    final=True))
+    finally:
+        handle.close()
+    return path
@@ -0,0 +1,226 @@
+""" Time imports of generated files and save the results as json
+
+    Each case is imported in its own process, into a test database that is
+    flushed between cases, so the peak memory is that of one import.
+    SQLite is used unless --postgres names a local database to test with.
+"""
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from optparse import OptionParser
+
+from django.conf import settings
+
+from csvimport.tests.benchmark.generate import generate, ITEM_MAPPINGS, \
+     COUNTRY_MAPPINGS
+
+# name: (file shape, model, mappings or '' to use the header row)
+CASES = {'country-header': ('country', 'tests.Country', ''),
+         'country-mappings': ('country', 'tests.Country', COUNTRY_MAPPINGS),
+         'item-header': ('item', 'tests.Item', ''),
+         'item-mappings': ('item', 'tests.Item', ITEM_MAPPINGS)}
+CHARSETS = ('utf-8', 'latin-1', 'utf-16')
+
+
+def peak_memory():
+    """ Peak memory of this process in KB, from tracemalloc if there
+        is one, otherwise the maximum resident set size
+    """
+    try:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1] // 1024
+    except ImportError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def import_case(path, modelname, mappings, charset, deduplicate, batch_size,
+                results):
+    """ Import a file in a child process and put its result on the queue """
+    from django.db import connection
+    from csvimport.management.commands.csvimport import Command
+    try:
+        import tracemalloc
+        tracemalloc.start()
+    except ImportError:
+        pass
+    result = {}
+    try:
+        start = time.time()
+        cmd = Command()
+        cmd.setup(mappings=mappings, modelname=modelname, charset=charset,
+                  csvfile=path, deduplicate=deduplicate,
+                  batch_size=batch_size, stats=True)
+        cmd.run()
+        seconds = time.time() - start
+        if len(cmd.error_log):
+            # Timing the logging of failed rows is not timing an import
+            raise Exception('%s row errors, eg. %s' % (
+                            len(cmd.error_log), cmd.error_log.lines()[0]))
+        stats = cmd.stats.as_dict()
+        result = {'seconds': round(seconds, 3),
+                  'rows_per_second': round(stats['rows'] / seconds, 1),
+                  'queries': stats['queries'],
+                  'stats': stats}
+    except Exception, err:
+        result = {'error': '%s: %s' % (err.__class__.__name__, err)}
+    result['peak_memory_kb'] = peak_memory()
+    connection.close()
+    results.put(result)
+
+
+def run_case(path, modelname, mappings, charset, deduplicate, batch_size):
+    """ Run one import in a new process and flush the database after """
+    from django.core.management import call_command
+    from django.db import connection
+    connection.close()
+    results = Queue()
+    child = Process(target=import_case,
+                    args=(path, modelname, mappings, charset, deduplicate,
+                          batch_size, results))
+    child.start()
+    result = results.get()
+    child.join()
+    call_command('flush', interactive=False, verbosity=0)
+    return result
+
+
+def commit():
+    """ The git commit of the code being benchmarked, if known """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(__file__), stderr=subprocess.STDOUT).strip()
+    except Exception:
+        return ''
+
+
+def case_key(result):
+    return (result['case'], result['rows'], result['charset'],
+            result['deduplicate'])
+
+
+def compare(results, baseline):
+    """ Print the change in rows per second from a baseline results file """
+    before = dict([(case_key(result), result)
+                   for result in json.load(open(baseline))['results']])
+    for result in results:
+        old = before.get(case_key(result), {})
+        if 'rows_per_second' in result and old.get('rows_per_second'):
+            change = '%+.1f%%' % (100.0 * result['rows_per_second'] /
+                                  old['rows_per_second'] - 100)
+        else:
+            change = 'n/a'
+        print '%s %s rows %s dedup=%s: %s rows/s (%s)' % (
+            result['case'], result['rows'], result['charset'],
+            result['deduplicate'], result.get('rows_per_second', 'error'),
+            change)
+
+
+def use_postgres(name):
+    """ Point the default database at a local Postgres database """
+    try:
+        import psycopg2
+    except ImportError:
+        print 'psycopg2 is not installed so using SQLite'
+        return False
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'NAME': name,
+        'USER': os.environ.get('PGUSER', ''),
+        'PASSWORD': os.environ.get('PGPASSWORD', ''),
+        'HOST': os.environ.get('PGHOST', ''),
+        'PORT': os.environ.get('PGPORT', '')}
+    return True
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--rows', default='10000',
+                      help='Comma separated numbers of rows to import')
+    parser.add_option('--cases', default=','.join(sorted(CASES)),
+                      help='Comma separated cases from %s' %
+                           ', '.join(sorted(CASES)))
+    parser.add_option('--charsets', default=','.join(CHARSETS),
+                      help='Comma separated charsets to write the files in')
+    parser.add_option('--cardinality', default=100, type='int',
+                      help='Number of distinct related values')
+    parser.add_option('--duplicates', default=0.1, type='float',
+                      help='Fraction of rows repeating an earlier row')
+    parser.add_option('--batch-size', default=1000, type='int',
+                      dest='batch_size')
+    parser.add_option('--postgres', default='',
+                      help='Name of a local Postgres database to use')
+    parser.add_option('--output', default='benchmark.json',
+                      help='File to write the json results to')
+    parser.add_option('--compare', default='',
+                      help='Results file of an earlier run to compare with')
+    options, args = parser.parse_args(argv)
+
+    # Per row logging and query recording would dominate the timings
+    settings.CSVIMPORT_LOG = 'screen'
+    settings.DEBUG = False
+    workdir = tempfile.mkdtemp(prefix='csvimport-benchmark-')
+    if not (options.postgres and use_postgres(options.postgres)):
+        settings.DATABASES['default']['TEST_NAME'] = os.path.join(
+            workdir, 'benchmark.db')
+
+    from django.db import connection
+    old_name = connection.creation.create_test_db(verbosity=0,
+                                                  autoclobber=True)
+    results = []
+    try:
+        for rows in [int(rows) for rows in options.rows.split(',')]:
+            for name in options.cases.split(','):
+                shape, modelname, mappings = CASES[name]
+                for charset in options.charsets.split(','):
+                    for deduplicate in (True, False):
+                        # Without deduplication repeated rows are inserted
+                        # again, which fails for primary keys
+                        duplicates = deduplicate and options.duplicates or 0
+                        path = os.path.join(workdir, '%s-%s-%s-%s.csv' % (
+                                            shape, rows, charset, duplicates))
+                        if not os.path.exists(path):
+                            generate(path, shape, rows, options.cardinality,
+                                     duplicates, charset)
+                        result = run_case(path, modelname, mappings, charset,
+                                          deduplicate, options.batch_size)
+                        result.update({'case': name, 'rows': rows,
+                                       'charset': charset,
+                                       'deduplicate': deduplicate})
+                        results.append(result)
+                        print '%(case)s %(rows)s %(charset)s ' \
+                              'dedup=%(deduplicate)s: ' % result + \
+                              str(result.get('rows_per_second',
+                                             result.get('error')))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        shutil.rmtree(workdir)
+
+    output = {'commit': commit(),
+              'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'python': platform.python_version(),
+              'database': connection.vendor,
+              'cardinality': options.cardinality,
+              'duplicates': options.duplicates,
+              'batch_size': options.batch_size,
+              'results': results}
+    handle = open(options.output, 'w')
+    try:
+        json.dump(output, handle, indent=2, sort_keys=True)
+    finally:
+        handle.close()
+    if options.compare:
+        compare(results, options.compare)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+""" Test the related model cache """
+import os
+import tempfile
+
+from csvimport.cache import RelatedCache
+from csvimport.related import RelatedResolver
+from csvimport.tests.testcase import CommandTestCase
+from csvimport.tests.models import Country, Organisation
+
+
+class RelatedCacheTest(CommandTestCase):
+    """ Run test of the least recently used related model cache """
+
+    def test_eviction(self):
+        """ The least recently used key is dropped when the cache is full """
+        cache = RelatedCache(Organisation, ['name'], maxsize=2)
+        for pk, name in enumerate(('Oxfam', 'Save UK', 'AID-France')):
+            if pk == 2:
+                # Use Oxfam so that Save UK is the least recently used
+                self.assertEqual(cache.get(cache.key({'name': 'Oxfam'})),
+                                 (0, {'name': 'Oxfam'}))
+            cache.put(cache.key({'name': name}), pk, {'name': name})
+        self.assertEqual(cache.get(cache.key({'name': 'Save UK'})), None)
+        self.assertEqual(cache.get(cache.key({'name': 'AID-France'}))[0], 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+    def test_warm(self):
+        """ Warming the cache loads the related rows with one query """
+        org = Organisation.objects.create(name='Save UK')
+        cache = RelatedCache(Organisation, ['name'])
+        with self.assertNumQueries(1):
+            cache.warm(['name'])
+        pk, values = cache.get(cache.key({'name': 'Save UK'}))
+        self.assertEqual(pk, org.pk)
+        self.assertEqual(cache.instance(pk, values).pk, org.pk)
+        self.assertFalse(cache.instance(pk, values)._state.adding)
+
+    def test_changed(self):
+        """ A cached related row whose values change in a later batch is
+            updated rather than inserted again
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, 'CODE_SHARE,ORGANISATION,UOM,CODE,NAME\r\n'
+                         'bucket,Save UK,Set,KE,Kenya\r\n'
+                         'tent,Save UK,Set,KE,Republic of Kenya\r\n')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        mappings = ('column1=code_share,'
+                    'column2=organisation(Organisation|name),'
+                    'column3=uom(UnitOfMeasure|name),'
+                    '*column4=country(Country|code),'
+                    'column5=country(Country|name)')
+        self.command(path, defaults='', mappings=mappings,
+                     expected_errs=['Using manually entered mapping list'])
+        self.assertEqual(Country.objects.get(code='KE').name,
+                         'Republic of Kenya')
+        self.assertEqual(self.get_item('tent').country.code, 'KE')
+
+    def test_keyless(self):
+        """ Related rows without values for the match fields each get
+            their own instance
+        """
+        resolver = RelatedResolver(Country, ['alias'])
+        failures = []
+        instances = resolver.resolve([{'code': 'KE', 'name': 'Kenya'},
+                                      {'code': 'UG', 'name': 'Uganda'}],
+                                     None, lambda *args: failures.append(args))
+        self.assertEqual([instance.code for instance in instances],
+                         ['KE', 'UG'])
+        self.assertEqual(Country.objects.count(), 2)
+        self.assertEqual(failures, [])
@@ -0,0 +1,70 @@
+""" Test the inference and parsing of date formats """
+from datetime import date, datetime
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from csvimport.dates import DateConverter
+from csvimport.errors import ErrorLog
+
+
+class DatesTest(SimpleTestCase):
+    """ Run test of date columns """
+
+    def test_infer(self):
+        """ The format that parses the sample is used for the column,
+            preferring day first if month first would also do
+        """
+        errors = ErrorLog()
+        convert = DateConverter()
+        convert.infer(['2014-03-18', '2014-12-01'])
+        self.assertEqual(convert.format, 'ISO')
+        self.assertEqual(convert('2014-03-18', 'date', errors),
+                         date(2014, 3, 18))
+        convert.infer(['01/02/2014', '18/03/2014'])
+        self.assertEqual(convert('01/02/2014', 'date', errors),
+                         date(2014, 2, 1))
+        convert.infer(['01/02/2014', '03/18/2014'])
+        self.assertEqual(convert.format, '%m/%d/%Y')
+        self.assertEqual(convert('01/02/2014', 'date', errors),
+                         date(2014, 1, 2))
+        self.assertEqual(convert('18/03/2014', 'date', errors), None)
+        self.assertEqual(errors.lines(),
+                         ['Column date = 18/03/2014 is not a date in the '
+                          'format %m/%d/%Y so is set to None'])
+
+    def test_unpadded(self):
+        """ ISO dates without leading zeros on the month or day """
+        errors = ErrorLog()
+        convert = DateConverter()
+        convert.infer(['2014-3-8', '2014-12-1'])
+        self.assertEqual(convert.format, 'ISO')
+        self.assertEqual(convert('2014-3-8', 'date', errors), date(2014, 3, 8))
+        self.assertEqual(DateConverter(datetimes=True)('2014-3-8', 'when',
+                                                       errors),
+                         datetime(2014, 3, 8))
+        self.assertEqual(len(errors), 0)
+
+    def test_datetimes(self):
+        """ A DateTimeField keeps the time, and a DateField drops it """
+        errors = ErrorLog()
+        convert = DateConverter(datetimes=True)
+        self.assertEqual(convert('2014-03-18 10:30:05', 'when', errors),
+                         datetime(2014, 3, 18, 10, 30, 5))
+        self.assertEqual(convert('2014-03-18', 'when', errors),
+                         datetime(2014, 3, 18))
+        convert.infer(['18/03/2014 10:30'])
+        self.assertEqual(convert('18/03/2014 10:30', 'when', errors),
+                         datetime(2014, 3, 18, 10, 30))
+        self.assertEqual(DateConverter()('2014-03-18T10:30:05', 'day', errors),
+                         date(2014, 3, 18))
+        # Spreadsheet date cells are not parsed
+        self.assertEqual(DateConverter()(datetime(2014, 3, 18, 10, 30), 'day',
+                                         errors), date(2014, 3, 18))
+        with override_settings(USE_TZ=True, TIME_ZONE='UTC'):
+            value = DateConverter(datetimes=True)('2014-03-18T10:30:05+01:00',
+                                                  'when', errors)
+            self.assertEqual(value, timezone.make_aware(
+                datetime(2014, 3, 18, 9, 30, 5), timezone.utc))
+        self.assertEqual(len(errors), 0)
@@ -37,6 +37,15 @@ class Organisation(models.Model):
         managed = True
 
 
+class Stock(models.Model):
+    """ Item stock held by an organisation, for imports with one
+        related model
+    """
+    code = models.CharField(max_length=32)
+    quantity = models.PositiveIntegerField(default=0)
+    organisation = models.ForeignKey(Organisation)
+
+
 class Item(models.Model):
     TYPE = models.PositiveIntegerField(default=0)
     code_share = models.CharField(
@@ -1,5 +1,5 @@
 """ Test use of optional command line args """
-from csvimport.tests.testcase import CommandTestCase
+from csvimport.tests.testcase import CommandTestCase, CHAR_ERR
 from csvimport.management.commands.csvimport import Command
 from csvimport.tests.models import Item
 
@@ -46,7 +46,7 @@ class CommandArgsTest(CommandTestCase):
             this is more normally used to allow setting values for missing columns
         """
         defaults='code_org=ALLTHESAME,quantity=58'
-        self.command(filename, defaults=defaults)
+        self.command(filename, defaults=defaults, expected_errs=[CHAR_ERR])
         item = self.get_item('watercan')
         self.assertNotEqual(item.code_org, 'CWATCONT20F')
         self.assertEqual(item.code_org, 'ALLTHESAME')
@@ -55,3 +55,11 @@ class CommandArgsTest(CommandTestCase):
         self.assertEqual(item.organisation.name, 'AID-France')
         Item.objects.all().delete()
 
+    def test_defaults_option(self):
+        """ The --defaults option is passed on to setup """
+        cmd = Command()
+        options = dict([(option.dest, option.default)
+                        for option in cmd.option_list])
+        options['defaults'] = 'country=KE(Country|code)'
+        self.assertEqual(cmd.import_options(options)['defaults'],
+                         'country=KE(Country|code)')
@@ -0,0 +1,190 @@
+""" Test splitting files for parallel imports """
+import bz2
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import unittest
+
+from csvimport.management.commands.csvimport import Command
+from csvimport.models import CSVImport
+from csvimport.parallel import record_boundaries, range_rows
+from csvimport.reader import file_fingerprint
+from csvimport.tests.testcase import CommandTestCase
+from csvimport.tests.models import Country
+
+
+class ParallelTest(CommandTestCase):
+    """ Run test of byte range splitting of csv files """
+
+    def write_csv(self, data):
+        """ Write the data to a temporary file and return its path """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, data)
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_boundaries(self):
+        """ Ranges start on records, even with quoted newlines """
+        data = ''.join(['%s,"multi\r\nline, ""quoted""\ncell",x\r\n' % i
+                        for i in range(500)])
+        path = self.write_csv(data)
+        expected = list(csv.reader(open(path, 'rb')))
+        for parts in (1, 2, 7, 50):
+            ranges = record_boundaries(path, parts)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], len(data))
+            rows = []
+            for start, end in ranges:
+                rows.extend(range_rows(path, start, end, 'utf-8'))
+            self.assertEqual(rows, expected)
+
+    def test_carriage_returns(self, filename='test_plain.csv'):
+        """ Files with only carriage return line endings can be split """
+        path = os.path.join(os.path.dirname(__file__), 'fixtures', filename)
+        ranges = record_boundaries(path, 3)
+        self.assertEqual(len(ranges), 3)
+        rows = []
+        for start, end in ranges:
+            rows.extend(range_rows(path, start, end, 'utf-8'))
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(rows[0][0], 'CODE_SHARE')
+
+    def test_deduplicate_one_process(self, filename='countries.csv'):
+        """ Deduplicated imports are not split between processes """
+        errs = ['Imported in one process since deduplication is on']
+        self.command(filename, defaults='', modelname='tests.Country',
+                     workers=2, expected_errs=errs)
+        self.assertEqual(Country.objects.count(), 246)
+        Country.objects.all().delete()
+
+    def test_directory(self, filename='countries.csv'):
+        """ Each file in a directory is imported with its own header
+            and log, and a failed file does not stop the others
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        lines = open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                  filename)).read().splitlines(True)
+        open(os.path.join(directory, 'a.csv'), 'w').write(''.join(lines[:11]))
+        # Same columns in a different order
+        rows = list(csv.reader([lines[0]] + lines[11:21]))
+        handle = open(os.path.join(directory, 'b.csv'), 'w')
+        csv.writer(handle).writerows([[row[1], row[0]] for row in rows])
+        handle.close()
+        open(os.path.join(directory, 'empty.csv'), 'w').close()
+        open(os.path.join(directory, 'notes.txt'), 'w').write('ignored')
+
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=directory)
+        errors = cmd.run()
+        self.assertEqual(errors[-1], 'Imported 20 rows from 3 files, 1 failed')
+        self.assertEqual(Country.objects.count(), 20)
+        self.assertEqual(CSVImport.objects.filter(
+                         file_name__startswith=directory).count(), 3)
+        Country.objects.all().delete()
+
+    def test_compressed(self, filename='countries.csv'):
+        """ Compressed files and each csv file of a zip are imported as
+            they are decompressed, with the charset detected from them
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        lines = open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                  filename)).read().splitlines(True)
+        handle = gzip.GzipFile(os.path.join(directory, 'a.csv.gz'), 'wb')
+        handle.write(''.join(lines[:11]))
+        handle.close()
+        text = ''.join(lines[:1] + lines[11:21]).decode('utf-8')
+        handle = bz2.BZ2File(os.path.join(directory, 'b.csv.bz2'), 'wb')
+        handle.write(text.encode('utf-16'))
+        handle.close()
+        archive = zipfile.ZipFile(os.path.join(directory, 'c.zip'), 'w',
+                                  zipfile.ZIP_DEFLATED)
+        archive.writestr('c1.csv', ''.join(lines[:1] + lines[21:31]))
+        archive.writestr('c2.csv', ''.join(lines[:1] + lines[31:41]))
+        archive.writestr('readme.txt', 'ignored')
+        archive.close()
+
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=directory)
+        errors = cmd.run()
+        self.assertEqual(errors[-1], 'Imported 40 rows from 4 files, 0 failed')
+        self.assertEqual(Country.objects.count(), 40)
+        self.assertEqual(CSVImport.objects.filter(
+                         file_name=os.path.join(directory, 'c.zip:c2.csv'),
+                         encoding__startswith='utf-8').count(), 1)
+        Country.objects.all().delete()
+
+
+@unittest.skipIf(connection.vendor == 'sqlite' and
+                 connection.settings_dict.get('TEST_NAME') in (None, '',
+                                                               ':memory:'),
+                 'Workers cannot share an in memory database')
+class ParallelImportTest(TransactionTestCase):
+    """ Run test of imports split between worker processes, which need
+        a database they can all connect to and a committed transaction
+    """
+
+    def test_workers(self, filename='countries.csv'):
+        """ Each worker imports its byte range and the logs are merged """
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=os.path.join(os.path.dirname(__file__), 'fixtures',
+                                       filename),
+                  deduplicate=False, workers=3, batch_size=100)
+        cmd.run()
+        self.assertEqual(cmd.loglist[-1], 'Imported 246 rows with 3 workers')
+        self.assertEqual(cmd.rowcount, 246)
+        self.assertEqual(Country.objects.count(), 246)
+        self.assertEqual(Country.objects.get(code='GB').name,
+                         'UNITED KINGDOM')
+
+    def test_resume(self, filename='countries.csv'):
+        """ A resumed import only splits the rows after its checkpoint """
+        lines = open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                  filename)).read().splitlines(True)[:101]
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, ''.join(lines))
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        # As if a one process import stopped after the fortieth row
+        csvimport_id = CSVImport.objects.create(
+            model_name='tests.Country', file_name=path,
+            fingerprint=file_fingerprint(path), checkpoint_row=40,
+            checkpoint_offset=len(''.join(lines[:41]))).id
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=path, deduplicate=False, workers=3,
+                  resume=csvimport_id)
+        cmd.run(logid=csvimport_id)
+        self.assertEqual(cmd.rowcount, 60)
+        self.assertEqual(Country.objects.count(), 60)
+        self.assertFalse(Country.objects.filter(
+                         code=lines[40].split(',')[1].strip('"')).exists())
+
+    def test_decode_errors(self, filename='countries.csv'):
+        """ The rows with bytes replaced by the workers are logged """
+        lines = open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                  filename)).read().splitlines(True)[:61]
+        for index in (5, 30, 55):
+            lines[index] = lines[index].replace('"', '"\xff', 1)
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, ''.join(lines))
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='utf-8',
+                  csvfile=path, deduplicate=False, workers=3)
+        cmd.run()
+        self.assertEqual(cmd.loglist[-1], 'Imported 60 rows with 3 workers')
+        self.assertTrue('Replaced the bytes that are not valid utf-8 in 3 '
+                        'rows' in cmd.loglist)
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
 # Use unicode source code to make test character string writing easier
-from csvimport.tests.testcase import CommandTestCase
+import os
+import tempfile
+
+from django.db.models.signals import class_prepared
+from django.utils.unittest import skipUnless
+
+from csvimport.tests.testcase import CommandTestCase, DummyFileObj, CHAR_ERR
+from StringIO import StringIO
 from csvimport.management.commands.csvimport import Command
-from csvimport.tests.models import Item
+from csvimport.errors import ErrorLog
+from csvimport.reader import CSVReader, detect_charset
+from csvimport.xlsx import load_workbook
+from csvimport.plan import ImportPlan, to_integer, to_positive
+from csvimport.metadata import field_map, related_model, parse_mappings
+from csvimport.tests.models import Item, UnitOfMeasure
+
+if load_workbook:
+    from openpyxl import Workbook
 
 
 class CommandParseTest(CommandTestCase):
@@ -21,7 +36,7 @@ class CommandParseTest(CommandTestCase):
 
     def test_char(self, filename='test_char.csv'):
         """ Use custom command parse file - test with odd non-ascii character """
-        self.command(filename)
+        self.command(filename, expected_errs=[CHAR_ERR])
         item = self.get_item('watercan')
         self.assertEqual(item.code_org, 'CWATCONT20F')
         self.assertEqual(item.quantity, 1000)
@@ -73,3 +88,147 @@ class CommandParseTest(CommandTestCase):
         self.assertNotEqual(items[0].quantity, 9999999999999999999999999999)
         Item.objects.all().delete()
 
+
+    def test_streaming(self, filename='test_plain.csv'):
+        """ Check that setup only peeks the header and leaves the rows
+            to be read lazily by run
+        """
+        cmd = Command()
+        uploaded = DummyFileObj()
+        uploaded.set_path(filename)
+        cmd.setup(mappings='', modelname='tests.Item', charset='',
+                  uploaded=uploaded)
+        self.assertFalse(isinstance(cmd.csvfile, list))
+        self.assertEqual(cmd.header[0], 'CODE_SHARE')
+        self.assertEqual(next(cmd.csvfile), cmd.header)
+        self.assertEqual(next(cmd.csvfile)[0], 'bucket')
+
+    def test_charset(self):
+        """ Check charset detection only reads a bounded sample """
+        self.assertEqual(detect_charset(StringIO('\xef\xbb\xbfa,b\n')),
+                         ('utf-8-sig', 3))
+        data = u'caf\xe9,na\xefve\n'.encode('utf-8') * 100
+        self.assertEqual(detect_charset(StringIO(data)), ('utf-8', len(data)))
+        data = u'caf\xe9,na\xefve\n'.encode('latin-1') * 100
+        charset, examined = detect_charset(StringIO(data), sample=128)
+        self.assertTrue(examined <= 128)
+        self.assertEqual(data.decode(charset), data.decode('latin-1'))
+
+    def test_reader(self):
+        """ Rows read from raw bytes or recoded from UTF-16 are the same,
+            and reading from an offset starts with the header row
+        """
+        text = u'name,note\r\ncaf\xe9,"two\nlines"\r\nna\xefve,\u5220\r\n'
+        rows = [[u'name', u'note'], [u'caf\xe9', u'two\nlines'],
+                [u'na\xefve', u'\u5220']]
+        paths = {}
+        for charset in ('utf-8', 'utf-16'):
+            handle, paths[charset] = tempfile.mkstemp(suffix='.csv')
+            os.write(handle, text.encode(charset))
+            os.close(handle)
+            self.addCleanup(os.remove, paths[charset])
+            reader = CSVReader(paths[charset])
+            self.assertEqual(reader.charset, charset)
+            self.assertEqual(list(reader), rows)
+            self.assertEqual(reader.decode_errors, 0)
+        self.assertEqual(reader.offset, None)
+        start = len(text[:text.index(u'na\xef')].encode('utf-8'))
+        reader = CSVReader(paths['utf-8'], 'utf-8', start)
+        self.assertEqual(list(reader), [rows[0], rows[2]])
+        self.assertEqual(reader.offset, len(text.encode('utf-8')))
+        reader = CSVReader(paths['utf-8'], 'ascii')
+        self.assertEqual(list(reader)[1][0], u'caf\ufffd\ufffd')
+        self.assertEqual(reader.decode_errors, 2)
+
+    @skipUnless(load_workbook, 'openpyxl is not installed')
+    def test_xlsx(self):
+        """ A worksheet is imported with its numbers kept as numbers,
+            and those in text columns as the text they would be in a csv
+        """
+        workbook = Workbook()
+        workbook.active.title = 'Notes'
+        sheet = workbook.create_sheet('Items')
+        sheet.append(['CODE_SHARE', 'CODE_ORG', 'ORGANISATION', 'UOM',
+                      'QUANTITY'])
+        sheet.append(['bucket', 41, 'Save UK', 'Set', 300])
+        sheet.append([None, None, None, None, None])
+        sheet.append(['tent', 'RF024', 'Save UK', 12, 45.0])
+        handle, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        workbook.save(path)
+        self.command(path, defaults='', sheet='Items')
+        item = self.get_item('bucket')
+        self.assertEqual(item.code_org, '41')
+        self.assertEqual(item.quantity, 300)
+        item = self.get_item('tent')
+        self.assertEqual(item.quantity, 45)
+        self.assertEqual(item.uom.name, '12')
+        self.assertEqual(Item.objects.count(), 2)
+        Item.objects.all().delete()
+
+    def test_metadata(self):
+        """ Field maps, related models and parsed mappings are kept for the
+            process until a model class is prepared
+        """
+        fieldmap = field_map(Item)
+        self.assertEqual(fieldmap['organisation_id'].name, 'organisation')
+        self.assertTrue(field_map(Item) is fieldmap)
+        self.assertEqual(related_model('unitofmeasure', 'tests'),
+                         UnitOfMeasure)
+        mappings = parse_mappings('column1=code,*column2=org(Organisation|name)')
+        self.assertEqual(mappings, ((('1', 'code', None),
+                                     ('2', 'org', ('Organisation', 'name'))),
+                                    (), ('name',)))
+        self.assertTrue(parse_mappings('column1=code,*column2=org'
+                                       '(Organisation|name)') is mappings)
+        class_prepared.send(sender=Item)
+        self.assertFalse(field_map(Item) is fieldmap)
+
+    def test_plan(self):
+        """ Check the import plan resolves named columns and converts cells """
+        fieldmap = dict([(field.name, field) for field in Item._meta.fields])
+        mappings = [('QUANTITY', 'quantity', None),
+                    ('ORGANISATION', 'organisation', ('Organisation', 'name'))]
+        plan = ImportPlan(mappings, fieldmap, header=['ORGANISATION', 'QUANTITY'],
+                          nameindexes=True)
+        self.assertEqual(plan.related, {'organisation': 'Organisation'})
+        errors = ErrorLog()
+        row = [' Save UK ', '-23']
+        self.assertEqual(plan.apply(row, errors),
+                         ({'quantity': 0}, {'organisation': {'name': 'Save UK'}}))
+        self.assertEqual(row, ['Save UK', 0])
+        self.assertEqual(errors.lines(),
+                         ['Column quantity = -23, less than zero so set to 0'])
+
+    def test_integer_bounds(self):
+        """ Integers beyond the database's range either way are set to 0 """
+        errors = ErrorLog()
+        self.assertEqual(to_integer(float('-99999999999999999999'), 'quantity',
+                                    errors), 0)
+        self.assertEqual(to_integer(-99999999999999999999L, 'quantity',
+                                    errors), 0)
+        self.assertEqual(to_integer(-9223372036854775807L, 'quantity',
+                                    errors), -9223372036854775807L)
+        self.assertEqual(errors.as_dict(),
+                         {'quantity: less than the min integer': 2})
+
+    def test_error_log(self):
+        """ Errors are counted by column and kind with a few samples,
+            and all of them written to the side file
+        """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        errors = ErrorLog(samples=2, path=path)
+        for row in range(5):
+            errors.row = row
+            to_positive(-row, 'quantity', errors)
+        errors.close()
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(errors.lines(),
+                         ['Column quantity = -1, less than zero so set to 0',
+                          'Column quantity = -2, less than zero so set to 0',
+                          '2 more less than zero errors in column quantity'])
+        self.assertEqual(errors.as_dict(), {'quantity: less than zero': 4})
+        self.assertEqual(len(open(path).readlines()), 4)
@@ -0,0 +1,206 @@
+""" Test the number of queries run by each mode of import """
+import os
+import shutil
+import tempfile
+
+from csvimport.management.commands.csvimport import Command
+from csvimport.tests.testcase import CommandTestCase, DummyFileObj
+from csvimport.tests.models import Country, Item, Organisation, Stock, \
+    UnitOfMeasure
+
+COUNTRIES = 246
+STOCK = 8
+ITEMS = 8
+STOCK_MAPPINGS = ('column1=code,column6=quantity,'
+                  'column3=organisation(Organisation|name)')
+
+
+# Queries to create and release a savepoint
+SAVEPOINT = 2
+
+
+def budget(rows, per_row=0, batch_size=1, per_batch=0, fixed=0,
+           writes=True):
+    """ The most queries an import of rows may run
+        Within the test's transaction the import's transaction is a
+        savepoint, and so is each batch that writes rows
+    """
+    batches = (rows + batch_size - 1) // batch_size
+    if writes:
+        per_batch += SAVEPOINT
+    return fixed + SAVEPOINT + rows * per_row + batches * per_batch
+
+
+class QueryBudgetTest(CommandTestCase):
+    """ Run test of the queries per row and per batch of imports, so
+        that an extra query for each row fails rather than slowing
+        down large imports
+    """
+
+    def stock(self):
+        """ Import the stock and return the command """
+        cmd = Command()
+        uploaded = DummyFileObj()
+        uploaded.set_path('test_plain.csv')
+        cmd.setup(mappings=STOCK_MAPPINGS, modelname='tests.Stock',
+                  charset='', uploaded=uploaded)
+        cmd.run(logid='querytest')
+        return cmd
+
+    def countries(self, **options):
+        self.command('countries.csv', defaults='', modelname='tests.Country',
+                     **options)
+
+    def test_plain(self):
+        """ One insert per row """
+        self.assertQueryBudget(budget(COUNTRIES, per_row=1),
+                               self.countries, deduplicate=False)
+        self.assertEqual(Country.objects.count(), COUNTRIES)
+
+    def test_batch(self):
+        """ One bulk insert per batch """
+        self.assertQueryBudget(budget(COUNTRIES, batch_size=100, per_batch=1),
+                               self.countries, deduplicate=False,
+                               batch_size=100)
+
+    def test_dedup(self):
+        """ A lookup and an insert or update per row, or a lookup and a
+            bulk insert per batch and no writes for unchanged rows
+        """
+        self.assertQueryBudget(budget(COUNTRIES, per_row=2),
+                               self.countries)
+        self.assertQueryBudget(budget(COUNTRIES, per_row=1, writes=False),
+                               self.countries)
+        Country.objects.all().delete()
+        self.assertQueryBudget(budget(COUNTRIES, batch_size=100, per_batch=2),
+                               self.countries, batch_size=100)
+        self.assertQueryBudget(budget(COUNTRIES, batch_size=100, per_batch=1,
+                                      writes=False),
+                               self.countries, batch_size=100)
+
+    def test_related(self):
+        """ Each related instance is looked up and saved once, in a
+            savepoint, then cached
+        """
+        cmd = self.assertQueryBudget(budget(STOCK, per_row=2,
+                                            fixed=2 + SAVEPOINT),
+                                     self.stock)
+        self.assertEqual(Stock.objects.count(), STOCK)
+        self.assertEqual((cmd.related['organisation'].cache.hits,
+                          cmd.related['organisation'].cache.misses), (7, 1))
+
+    def test_foreign_keys(self):
+        """ Each foreign key is looked up and its missing instances
+            inserted once per batch, so the queries do not grow with
+            the rows, and the related models are found without queries
+        """
+        per_fk = 1 + 1 + SAVEPOINT
+        self.assertQueryBudget(budget(ITEMS, batch_size=100,
+                                      per_batch=2 + 3 * per_fk),
+                               self.command, 'test_plain.csv',
+                               batch_size=100)
+        item = Item.objects.get(code_org='RF007')
+        self.assertEqual((item.organisation.name, item.uom.name,
+                          item.country.code), ('Save UK', 'Metre', 'KE'))
+        self.assertEqual(UnitOfMeasure.objects.count(), 4)
+
+    def test_foreign_keys_no_dedup(self):
+        """ Without deduplication the new related instances of each
+            foreign key are inserted together once per batch
+        """
+        per_fk = 1 + SAVEPOINT
+        self.assertQueryBudget(budget(ITEMS, batch_size=100,
+                                      per_batch=1 + 2 * per_fk),
+                               self.command, 'test_plain.csv', defaults='',
+                               batch_size=100, deduplicate=False)
+        self.assertEqual(Item.objects.count(), ITEMS)
+        self.assertEqual(UnitOfMeasure.objects.count(), ITEMS)
+        item = Item.objects.get(code_org='RF007')
+        self.assertEqual((item.organisation.name, item.uom.name),
+                         ('Save UK', 'Metre'))
+        self.assertEqual(len(set(Item.objects.values_list('uom_id',
+                                                          flat=True))), ITEMS)
+
+    def test_directory(self):
+        """ A fixed number of queries per file for its CSVImport log,
+            and the savepoints of its transaction and its batch
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        lines = open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                  'countries.csv')).read().splitlines(True)
+        for name, start in (('a.csv', 1), ('b.csv', 11)):
+            open(os.path.join(directory, name), 'w').write(
+                ''.join(lines[:1] + lines[start:start + 10]))
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=directory, deduplicate=False, batch_size=100)
+        self.assertQueryBudget(2 * (5 + 2 * SAVEPOINT), cmd.run)
+        self.assertEqual(Country.objects.count(), 20)
+
+    def test_upsert(self):
+        """ One upsert statement per batch, whether the rows are new
+            or existing, matching on the mapped primary key
+        """
+        for repeat in range(2):
+            self.assertQueryBudget(budget(COUNTRIES, batch_size=100,
+                                          per_batch=1),
+                                   self.countries, batch_size=100,
+                                   upsert=True)
+        self.assertEqual(Country.objects.count(), COUNTRIES)
+        Country.objects.filter(code='GB').update(name='Changed')
+        self.countries(batch_size=100, upsert=True)
+        self.assertEqual(Country.objects.get(code='GB').name,
+                         'UNITED KINGDOM')
+
+    def test_upsert_auto_pk(self):
+        """ A mapped automatic primary key is written and matched on """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, 'id,name\r\n1,Save UK\r\n2,Oxfam\r\n')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        for repeat in range(2):
+            self.command(path, defaults='', modelname='tests.Organisation',
+                         upsert=True, batch_size=10)
+        self.assertEqual(list(Organisation.objects.order_by('id').values_list(
+                         'id', 'name')), [(1, 'Save UK'), (2, 'Oxfam')])
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Organisation', charset='',
+                  csvfile=path, upsert=True, batch_size=10)
+        cmd.run()
+        self.assertEqual(cmd.importlist, [1, 2])
+
+    def test_loader_auto_pk(self):
+        """ The loaders write mapped automatic primary keys """
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, 'id,name\r\n5,Save UK\r\n7,Oxfam\r\n')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        for loader in ('orm', 'executemany'):
+            self.command(path, defaults='', modelname='tests.Organisation',
+                         deduplicate=False, batch_size=10, loader=loader)
+            self.assertEqual(list(Organisation.objects.order_by(
+                             'id').values_list('id', 'name')),
+                             [(5, 'Save UK'), (7, 'Oxfam')])
+            Organisation.objects.all().delete()
+
+    def test_loaders(self):
+        """ Each loader writes a batch with one statement, and a loader
+            the database does not support falls back to its own loader
+        """
+        for loader in ('orm', 'executemany'):
+            self.assertQueryBudget(budget(COUNTRIES, batch_size=100,
+                                          per_batch=1),
+                                   self.countries, deduplicate=False,
+                                   batch_size=100, loader=loader)
+            self.assertEqual(Country.objects.count(), COUNTRIES)
+            Country.objects.all().delete()
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=os.path.join(os.path.dirname(__file__), 'fixtures',
+                                       'countries.csv'),
+                  batch_size=100, loader='copy')
+        cmd.run()
+        self.assertTrue('Using the ExecuteManyLoader loader since the copy '
+                        'loader does not support sqlite' in cmd.loglist)
+        self.assertEqual(Country.objects.count(), COUNTRIES)
@@ -0,0 +1,67 @@
+""" Test queued imports of admin uploads and of watched folders """
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+
+from csvimport.executor import DatabaseQueue
+from csvimport.models import CSVImport, fs
+from csvimport.tests.testcase import CommandTestCase
+from csvimport.tests.models import Country
+
+
+class QueueTest(CommandTestCase):
+    """ Run test of the database queue, csvimport_worker and csvimport_watch """
+
+    def queue_upload(self, filename):
+        """ Queue a CSVImport as the admin does for an upload """
+        path = os.path.join(os.path.dirname(__file__), 'fixtures', filename)
+        csvimp = CSVImport.objects.create(
+            model_name='tests.Country',
+            upload_file=os.path.relpath(path, fs.location),
+            file_name=filename)
+        return DatabaseQueue().submit(csvimp)
+
+    def test_worker(self, filename='countries.csv'):
+        """ The worker imports queued uploads and records their progress """
+        csvimp = self.queue_upload(filename)
+        self.assertEqual(CSVImport.objects.get(pk=csvimp.pk).status, 'queued')
+        call_command('csvimport_worker', once=True)
+        csvimp = CSVImport.objects.get(pk=csvimp.pk)
+        self.assertEqual(csvimp.status, 'done')
+        self.assertEqual(csvimp.rows_processed, 246)
+        self.assertEqual(Country.objects.count(), 246)
+        self.assertEqual(DatabaseQueue().claim(), None)
+        Country.objects.all().delete()
+
+    def test_failed(self, filename='countries.csv'):
+        """ An import that cannot run is marked as failed """
+        csvimp = self.queue_upload(filename)
+        CSVImport.objects.filter(pk=csvimp.pk).update(model_name='tests.Missing')
+        call_command('csvimport_worker', once=True)
+        self.assertEqual(CSVImport.objects.get(pk=csvimp.pk).status, 'failed')
+
+    def test_watch(self, filename='countries.csv'):
+        """ Files dropped in the folder are imported then moved to done,
+            or failed, and other files are left alone
+        """
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        shutil.copy(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                 filename), os.path.join(folder, 'a.csv'))
+        open(os.path.join(folder, 'broken.zip'), 'w').write('PK\x03\x04')
+        open(os.path.join(folder, 'notes.txt'), 'w').write('ignored')
+        call_command('csvimport_watch', folder, model='tests.Country',
+                     once=True)
+        self.assertEqual(Country.objects.count(), 246)
+        self.assertEqual(sorted(os.listdir(folder)),
+                         ['done', 'failed', 'notes.txt', 'processing'])
+        self.assertEqual(os.listdir(os.path.join(folder, 'done')), ['a.csv'])
+        self.assertEqual(os.listdir(os.path.join(folder, 'failed')),
+                         ['broken.zip'])
+        # Recorded under the name it was dropped with
+        self.assertEqual(CSVImport.objects.get(
+                         file_name=os.path.join(folder, 'a.csv')).rows_processed,
+                         246)
+        Country.objects.all().delete()
@@ -0,0 +1,96 @@
+""" Test checkpoints and resuming unfinished imports """
+import gzip
+import os
+import tempfile
+
+from csvimport.management.commands.csvimport import Command
+from csvimport.models import CSVImport
+from csvimport.reader import ByteLines, file_fingerprint
+from csvimport.tests.testcase import CommandTestCase
+from csvimport.tests.models import Country
+
+
+class ResumeTest(CommandTestCase):
+    """ Run test of resuming imports from their checkpoints """
+
+    def write_countries(self, count, filename='countries.csv'):
+        """ Write the header and first count countries to a temporary file
+            Returns its path and lines
+        """
+        lines = open(os.path.join(os.path.dirname(__file__), 'fixtures',
+                                  filename)).read().splitlines(True)
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        os.write(handle, ''.join(lines[:count + 1]))
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        return path, lines[:count + 1]
+
+    def import_countries(self, path, resume=None):
+        """ Import the file with the CSVImport log added first, as the
+            command does, and return the log id
+        """
+        csvimport_id = resume or CSVImport.objects.create(
+            model_name='tests.Country', file_name=path).id
+        cmd = Command()
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  csvfile=path, resume=resume)
+        cmd.run(logid=csvimport_id)
+        return csvimport_id
+
+    def test_byte_lines(self):
+        """ The offset is the end of the last line read """
+        path, lines = self.write_countries(3)
+        reader = ByteLines(path)
+        offsets = [len(''.join(lines[:i + 1])) for i in range(len(lines))]
+        read = []
+        for line in reader:
+            read.append(reader.offset)
+        self.assertEqual(read, offsets)
+        self.assertEqual(list(ByteLines(path, offsets[1])), lines[2:])
+
+    def test_resume(self):
+        """ Resuming skips the rows before the checkpoint """
+        path, lines = self.write_countries(20)
+        csvimport_id = self.import_countries(path)
+        csvimp = CSVImport.objects.get(pk=csvimport_id)
+        self.assertEqual(csvimp.checkpoint_row, 20)
+        self.assertEqual(csvimp.checkpoint_offset, os.path.getsize(path))
+        self.assertEqual(csvimp.fingerprint, file_fingerprint(path))
+        Country.objects.all().delete()
+
+        # As if the import stopped after the tenth row
+        CSVImport.objects.filter(pk=csvimport_id).update(
+            checkpoint_row=10, checkpoint_offset=len(''.join(lines[:11])))
+        self.import_countries(path, resume=csvimport_id)
+        self.assertEqual(Country.objects.count(), 10)
+        self.assertEqual(CSVImport.objects.get(pk=csvimport_id).checkpoint_row,
+                         20)
+        Country.objects.all().delete()
+
+    def test_resume_changed(self):
+        """ An import cannot be resumed if its file has changed """
+        path, lines = self.write_countries(5)
+        csvimport_id = self.import_countries(path)
+        open(path, 'ab').write(lines[1])
+        self.assertRaises(Exception, self.import_countries, path,
+                          resume=csvimport_id)
+        Country.objects.all().delete()
+
+    def test_resume_compressed(self):
+        """ Resuming a file without byte offsets skips as many rows as were
+            committed, not counting blank lines
+        """
+        path, lines = self.write_countries(10)
+        handle = gzip.GzipFile(path, 'wb')
+        handle.write(''.join(lines[:3] + ['\r\n'] + lines[3:]))
+        handle.close()
+        csvimport_id = self.import_countries(path)
+        self.assertEqual(CSVImport.objects.get(pk=csvimport_id).checkpoint_row,
+                         10)
+        Country.objects.all().delete()
+
+        CSVImport.objects.filter(pk=csvimport_id).update(checkpoint_row=5,
+                                                         checkpoint_offset=0)
+        self.import_countries(path, resume=csvimport_id)
+        self.assertEqual(Country.objects.count(), 5)
+        Country.objects.all().delete()
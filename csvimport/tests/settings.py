@@ -7,6 +7,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'django-csvimport-test.db',
+        # A file rather than in memory so parallel import workers share it
+        'TEST_NAME': 'django-csvimport-test-run.db',
         'USER': '',     # Not used with sqlite3.
         'PASSWORD': '', # Not used with sqlite3.
         'HOST': '',     # Set to empty string for localhost. 
@@ -0,0 +1,42 @@
+""" Test the import stats """
+from csvimport.management.commands.csvimport import Command
+from csvimport.tests.testcase import CommandTestCase, DummyFileObj
+from csvimport.tests.models import Country
+
+
+class StatsTest(CommandTestCase):
+    """ Run test of the counts and timings of imports """
+
+    def import_countries(self, filename='countries.csv', **options):
+        """ Run the import and return the command """
+        cmd = Command()
+        uploaded = DummyFileObj()
+        uploaded.set_path(filename)
+        cmd.setup(mappings='', modelname='tests.Country', charset='',
+                  uploaded=uploaded, batch_size=100, **options)
+        cmd.run(logid='statstest')
+        return cmd
+
+    def test_counts(self):
+        """ Rows are counted as created then unchanged """
+        stats = self.import_countries().stats
+        self.assertEqual((stats.rows, stats.created, stats.unchanged), (246, 246, 0))
+        self.assertFalse('seconds' in stats.as_dict())
+        stats = self.import_countries().stats
+        self.assertEqual((stats.created, stats.updated, stats.unchanged), (0, 0, 246))
+        Country.objects.all().delete()
+
+    def test_timed(self):
+        """ Timed stats have the stage times, queries and progress """
+        progress = []
+        cmd = self.import_countries(stats=True, progress=progress.append)
+        stats = cmd.stats.as_dict()
+        self.assertEqual(sorted(stats['seconds'].keys()),
+                         ['convert', 'dedup', 'read', 'related', 'save',
+                          'signals'])
+        # One dedup query, one bulk insert and a savepoint per batch,
+        # within the savepoint of the import's transaction
+        self.assertEqual(stats['queries'], 14)
+        self.assertEqual(progress, [cmd.stats])
+        self.assertTrue(cmd.loglist[-1].startswith('Seconds per stage: read'))
+        Country.objects.all().delete()
@@ -1,13 +1,17 @@
 """ Base test case for command line manage.py csvimport """
 import os
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ObjectDoesNotExist
 
 from csvimport.management.commands.csvimport import Command
 from csvimport.tests.models import Item
 
 DEFAULT_ERRS = ['Using mapping from first row of CSV file', ]
+# The \x8f of test_char.csv is not valid in the charset detected for it
+CHAR_ERR = 'Replaced the bytes that are not valid Windows-1254 in 4 rows'
 
 
 class DummyFileObj():
@@ -27,21 +31,32 @@ class CommandTestCase(TestCase):
     def command(self, filename, 
                 defaults='country=KE(Country|code)',
                 mappings='',
-                expected_errs=[]):
-        """ Run core csvimport command to parse file """
+                expected_errs=[],
+                modelname='tests.Item',
+                **options):
+        """ Run core csvimport command to parse file
+            Any extra options are passed on to setup
+        """
         cmd = Command()
         uploaded = DummyFileObj()
         uploaded.set_path(filename)
         cmd.setup(mappings=mappings,
-                  modelname='tests.Item',
+                  modelname=modelname,
                   charset='',
                   uploaded=uploaded,
-                  defaults=defaults)
+                  defaults=defaults,
+                  **options)
 
         # Report back any unnexpected parse errors
         # and confirm those that are expected.
         # Fail test if they are not matching
         errors = cmd.run(logid='commandtest')
+        # The log ends with the use of each related model cache
+        if cmd.deduplicate and cmd.related:
+            summary = [resolver.cache.summary()
+                       for resolver in cmd.related.values()]
+            self.assertEqual(errors[-len(summary):], summary)
+            del errors[-len(summary):]
         expected = [err for err in DEFAULT_ERRS]
         if expected_errs:
             expected.extend(expected_errs)
@@ -57,6 +72,18 @@ class CommandTestCase(TestCase):
                 print err
         self.assertEqual(errors, [])
 
+    def assertQueryBudget(self, limit, func, *args, **kwargs):
+        """ Fail if calling func runs more than limit queries,
+            listing the queries it ran
+        """
+        with CaptureQueriesContext(connection) as context:
+            result = func(*args, **kwargs)
+        self.assertTrue(len(context) <= limit,
+                        '%s queries is over the budget of %s:\n%s' % (
+                        len(context), limit, '\n'.join(
+                        [query['sql'] for query in context.captured_queries])))
+        return result
+
     def get_item(self, code_share='sheeting'):
         """ Get item for confirming import is OK """
         try:
@@ -0,0 +1,99 @@
+""" Write batches of rows with the database's own insert or update
+
+    PostgreSQL 9.5+ and SQLite 3.24+ use INSERT ... ON CONFLICT and MySQL
+    uses INSERT ... ON DUPLICATE KEY UPDATE, so each batch is one statement
+    per chunk of rows rather than a read then a write per row, and
+    concurrent imports cannot race to insert the same row.
+"""
+from django.db import connections, router
+
+from .dedup import MAX_PARAMS
+from .loaders import Loader
+
+
+def upsert_supported(connection):
+    """ Does the database backend support a native upsert """
+    if connection.vendor == 'postgresql':
+        return (connection.pg_version or 0) >= 90500
+    if connection.vendor == 'sqlite':
+        from sqlite3 import sqlite_version_info
+        return sqlite_version_info >= (3, 24, 0)
+    return connection.vendor == 'mysql'
+
+
+def unique_constraint(model, names):
+    """ Are the fields the primary key, a unique field or unique together,
+        as the conflict target must be
+    """
+    names = set(names)
+    opts = model._meta
+    if len(names) == 1:
+        field = opts.get_field(list(names)[0])
+        if field.primary_key or field.unique:
+            return True
+    return names in [set(together) for together in opts.unique_together]
+
+
+class Upsert(Loader):
+    """ Insert rows, updating the given fields of any row that
+        conflicts on the unique conflict fields
+    """
+
+    def __init__(self, model, conflict_fields, update_fields):
+        super(Upsert, self).__init__(model)
+        opts = model._meta
+        self.conflict = [opts.get_field(name) for name in conflict_fields]
+        self.update = [opts.get_field(name) for name in update_fields
+                       if name not in conflict_fields]
+        if self.auto_pk and (self.auto_pk in self.conflict
+                             or self.auto_pk.name in update_fields):
+            # The mapped primary key is written, so rows conflict on it
+            self.fields = self.all_fields
+            self.update = [field for field in self.update
+                           if field is not self.auto_pk]
+
+    @classmethod
+    def for_model(cls, model, conflict_fields, update_fields):
+        """ The Upsert for the model, or None with the reason it cannot
+            be used
+        """
+        connection = connections[router.db_for_write(model)]
+        if not upsert_supported(connection):
+            return None, 'the %s database does not support it' % connection.vendor
+        if not conflict_fields:
+            return None, 'no unique fields are marked with * or the primary key mapped'
+        if not unique_constraint(model, conflict_fields):
+            return None, '%s are not unique in %s' % (', '.join(conflict_fields),
+                                                      model.__name__)
+        return cls(model, conflict_fields, update_fields), ''
+
+    def statement(self, count):
+        """ The SQL to upsert count rows """
+        qn = self.connection.ops.quote_name
+        columns = self.quoted_columns()
+        row = '(%s)' % ', '.join(['%s'] * len(self.fields))
+        sql = 'INSERT INTO %s (%s) VALUES %s' % (
+            qn(self.model._meta.db_table), columns, ', '.join([row] * count))
+        if self.connection.vendor == 'mysql':
+            updates = self.update or self.conflict
+            return sql + ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+                ['%s = VALUES(%s)' % (qn(field.column), qn(field.column))
+                 for field in updates])
+        sql += ' ON CONFLICT (%s)' % ', '.join([qn(field.column)
+                                                for field in self.conflict])
+        if not self.update:
+            return sql + ' DO NOTHING'
+        return sql + ' DO UPDATE SET ' + ', '.join(
+            ['%s = EXCLUDED.%s' % (qn(field.column), qn(field.column))
+             for field in self.update])
+
+    def load(self, instances):
+        """ Upsert the instances, in chunks within the parameter limit """
+        size = max(1, MAX_PARAMS // len(self.fields))
+        cursor = self.connection.cursor()
+        for start in range(0, len(instances), size):
+            chunk = instances[start:start + size]
+            params = []
+            for instance in chunk:
+                params.extend(self.values(instance))
+            cursor.execute(self.statement(len(chunk)), params)
@@ -0,0 +1,90 @@
+""" Importing the files dropped in a folder, for the csvimport_watch command
+
+    A file is claimed by renaming it into the processing folder, which only
+    one watcher can do, then moved to the done or failed folder once it is
+    imported. Files are only claimed once they have not changed for a few
+    seconds, so that files still being copied in are left alone.
+"""
+import os
+import shutil
+import time
+
+from csvimport.parallel import import_file
+from csvimport.reader import csv_sources, SUFFIXES
+
+
+class DropFolder(object):
+    """ A folder of files to import with processing, done and failed
+        folders inside it
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.processing = os.path.join(path, 'processing')
+        self.done = os.path.join(path, 'done')
+        self.failed = os.path.join(path, 'failed')
+        for folder in (self.processing, self.done, self.failed):
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+
+    def pending(self, settle=0):
+        """ The names of the files waiting to be imported, oldest first,
+            that have not been modified for settle seconds
+        """
+        now = time.time()
+        files = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.startswith('.') or not name.endswith(SUFFIXES) \
+                   or not os.path.isfile(path):
+                continue
+            changed = os.path.getmtime(path)
+            if changed <= now - settle:
+                files.append((changed, name))
+        return [name for mtime, name in sorted(files)]
+
+    def claim(self, name):
+        """ Move a file to the processing folder, returning its new path,
+            or None if another watcher claimed it first
+        """
+        path = os.path.join(self.processing, name)
+        try:
+            os.rename(os.path.join(self.path, name), path)
+        except OSError:
+            return None
+        return path
+
+    def finish(self, path, failed):
+        """ Move a processed file to the done or failed folder, without
+            replacing an earlier file of the same name
+        """
+        folder = failed and self.failed or self.done
+        target = os.path.join(folder, os.path.basename(path))
+        if os.path.exists(target):
+            target = os.path.join(folder, '%s-%s' % (
+                time.strftime('%Y%m%d%H%M%S'), os.path.basename(path)))
+        shutil.move(path, target)
+        return target
+
+
+def import_claimed(task):
+    """ Import each csv file, or worksheet, of a claimed file with its own
+        CSVImport log, recorded under the name the file was dropped with.
+        Returns a summary of the imports.
+    """
+    options, path, name = task
+    results = []
+    error = ''
+    try:
+        for source, member in csv_sources(path):
+            results.append(import_file((options, source, member, name)))
+        if not results:
+            error = 'No csv files found in %s' % path
+    except Exception, err:
+        error = str(err)
+    return {'path': path,
+            'failed': bool(error) or any([result['failed']
+                                          for result in results]),
+            'rows': sum([result['rows'] for result in results]),
+            'csvimport_ids': [result['csvimport_id'] for result in results],
+            'error': error}
@@ -0,0 +1,83 @@
+""" Reading the rows of an Excel .xlsx worksheet
+
+    The workbook is opened in openpyxl's read only mode, which streams the
+    rows of a worksheet rather than loading the whole workbook, so memory
+    use does not grow with the size of the sheet. Numbers, dates and
+    booleans are kept as Python values rather than text.
+    openpyxl is optional and only needed to import .xlsx files.
+"""
+import zipfile
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+
+def is_xlsx(path):
+    """ Is the file an Excel .xlsx workbook """
+    if not zipfile.is_zipfile(path):
+        return False
+    archive = zipfile.ZipFile(path)
+    try:
+        return 'xl/workbook.xml' in archive.namelist()
+    finally:
+        archive.close()
+
+
+def cell_text(value):
+    """ A header cell as text """
+    if value is None:
+        return u''
+    return unicode(value)
+
+
+class XLSXReader(object):
+    """ The rows of a worksheet, the first unless a sheet name or number,
+        counting from 1, is given, as lists of cell values with empty
+        cells as empty strings. The header row is all text.
+        It has the attributes of a CSVReader, without offsets.
+    """
+    charset = 'xlsx'
+    examined = None
+    compression = None
+    lines = None
+    offset = None
+    decode_errors = 0
+
+    def __init__(self, path, sheet=''):
+        if load_workbook is None:
+            raise Exception('Reading %s needs openpyxl, pip install openpyxl'
+                            % path)
+        self.path = path
+        self.sheet = sheet or ''
+
+    def label(self):
+        return self.charset
+
+    def worksheet(self, workbook):
+        """ The selected worksheet of the workbook """
+        sheet = self.sheet
+        if not sheet:
+            return workbook.worksheets[0]
+        if sheet in workbook.sheetnames:
+            return workbook[sheet]
+        if str(sheet).isdigit() and 0 < int(sheet) <= len(workbook.worksheets):
+            return workbook.worksheets[int(sheet) - 1]
+        raise Exception('There is no sheet %s in %s, only %s' % (
+                        sheet, self.path, ', '.join(workbook.sheetnames)))
+
+    def __iter__(self):
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            rows = self.worksheet(workbook).iter_rows()
+            for row in rows:
+                yield [cell_text(cell.value) for cell in row]
+                break
+            for row in rows:
+                values = [u'' if cell.value is None else cell.value
+                          for cell in row]
+                # Formatted but empty rows are blank lines
+                yield values if values.count(u'') < len(values) else []
+        finally:
+            workbook.close()
@@ -34,6 +34,9 @@ setup(name='django-csvimport',
           'django-appconf>=0.5',
           'django>=1.4'
       ],
+      extras_require={
+          'xlsx': ['openpyxl>=2.4'],
+      },
       entry_points="""
       # -*- Entry points: -*-
       """,